@@ -0,0 +1,280 @@
+"""
+Benchmarks of the sync_subtitle module
+
+Generates synthetic subtitle (SRT) files and times the public sync_*
+functions, the scalar and NumPy engines of SubtitleDocument.retime(), plus
+parse-only and format-only microbenchmarks. Results
+(seconds, cues/s, MB/s and peak memory) are printed as JSON so they can be
+compared across releases.
+
+    python benchmark_sync_subtitle.py --sizes 1000 100000 --output bench.json
+
+Functions:
+
+generate_srt                 -- Writes a synthetic SRT file
+run_benchmarks               -- Runs all the benchmarks and returns the results
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import sync_subtitle
+
+__all__ = ['generate_srt', 'run_benchmarks']
+
+BATCH_FILES = 4
+
+WORDS = ('the', 'you', 'what', 'we', 'here', 'never', 'look', 'again', \
+    'tonight', 'really', 'Captain', 'ship', 'going', 'know', 'think', \
+    'don\'t', 'right', 'café', 'niño', 'straße')
+
+
+
+def generate_srt(output_file, cue_count, crlf=False, seed=0):
+    """
+    Writes a synthetic SRT file with realistic timings (short gaps, the odd
+    overlap), one to three text lines per cue, and some odd spacing: trailing
+    spaces after index lines and doubled blank lines. Timings are shortened
+    above 70000 cues to fit in the 100 hours of SRT timestamps. Returns the
+    size of the file in bytes.
+
+        output_file          -- Path to the SRT file to be written
+        cue_count            -- Number of cues
+        crlf                 -- True for CRLF line endings
+        seed                 -- Seed of the random generator
+    """
+    rand = random.Random(seed)
+    newline = '\r\n' if crlf else '\n'
+    # Timestamps have two hour digits: the timings of large files are
+    # shortened to keep the last cue under 100 hours
+    scale = min(1.0, 70000.0 / cue_count) if cue_count else 1.0
+    time_in_ms = rand.randint(0, 5000)
+    with open(output_file, 'w', encoding='utf-8', newline='') as outputfile:
+        for index in range(1, cue_count + 1):
+            start_time = time_in_ms
+            end_time = start_time + int(rand.randint(700, 6000) * scale)
+            time_in_ms = end_time + int(rand.randint(-200, 3000) * scale)
+            time_in_ms = max(time_in_ms, start_time + 1)
+            lines = [str(index) + (' ' if rand.random() < 0.02 else ''), \
+                sync_subtitle.ms_to_str(start_time) + ' --> ' + \
+                sync_subtitle.ms_to_str(end_time)]
+            for _ in range(rand.choice((1, 1, 2, 2, 3))):
+                lines.append(' '.join(rand.choice(WORDS) \
+                    for _ in range(rand.randint(2, 9))))
+            lines.append('')
+            if rand.random() < 0.01:
+                lines.append('')
+            outputfile.write(newline.join(lines) + newline)
+    return os.path.getsize(output_file)
+
+
+
+def _measure(function, repeat, memory):
+    """
+    Returns the best wall time of 'repeat' runs of 'function', and its peak
+    traced memory (measured in one extra run, as tracing slows it down).
+    """
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return (best, peak)
+
+
+
+def _benchmarks(input_file, work_file):
+    """
+    Returns the (name, function) pairs to be timed on 'input_file'.
+    """
+    def copy():
+        shutil.copyfile(input_file, work_file)
+
+    def with_copy(function):
+        def run():
+            copy()
+            function()
+        return run
+
+    def parse_lines():
+        with open(input_file, 'rb') as inputfile:
+            for each_line in inputfile:
+                sync_subtitle.get_start_and_end_times(\
+                    each_line.decode('utf-8', 'surrogateescape'))
+
+    document = sync_subtitle.SubtitleDocument.from_file(input_file)
+    times = list(zip(document.start_times, document.end_times))
+
+    def format_times():
+        for start_time, end_time in times:
+            sync_subtitle.ms_to_str(start_time) + ' --> ' + \
+                sync_subtitle.ms_to_str(end_time)
+
+    pipeline = sync_subtitle.SyncPipeline().sync(1500)
+
+    def sync_iter():
+        with open(input_file, 'rb') as inputfile:
+            for _ in sync_subtitle.sync_iter(inputfile, pipeline):
+                pass
+
+    def sync_stream():
+        with open(input_file, 'rb') as inputfile, \
+            open(os.devnull, 'wb') as outputfile:
+            sync_subtitle.sync_stream(inputfile, outputfile, pipeline)
+
+    # sync_batch() reads copies of the input and writes to another directory
+    directory = os.path.dirname(os.path.abspath(work_file))
+    batch_dir = os.path.join(directory, 'batch')
+    os.makedirs(batch_dir, exist_ok=True)
+    for number in range(BATCH_FILES):
+        shutil.copyfile(input_file, os.path.join(batch_dir, \
+            'episode{}.srt'.format(number)))
+
+    def sync_batch():
+        summary = sync_subtitle.sync_batch(batch_dir, pipeline, \
+            os.path.join(directory, 'batch_output'))
+        if summary.failed:
+            raise RuntimeError(summary.failed[0].error_message)
+
+    def retime(engine):
+        # A PAL speed-up with a negative offset, so the clamping rules apply
+        def run():
+            document.copy().retime(23.976 / 25, -1500, engine)
+        return run
+
+    engines = ['python'] + (['numpy'] if sync_subtitle.numpy else [])
+    return [
+        ('copy (baseline)', copy),
+        ('sync', with_copy(lambda: sync_subtitle.sync(work_file, 1500))),
+        ('sync (hasten)', with_copy(lambda: \
+            sync_subtitle.sync(work_file, 1500, False))),
+        ('sync_after_time', with_copy(lambda: \
+            sync_subtitle.sync_after_time('00:20:00,000', work_file, 1500))),
+        ('sync_before_time', with_copy(lambda: \
+            sync_subtitle.sync_before_time('00:20:00,000', work_file, 1500))),
+        ('sync_between_times', with_copy(lambda: \
+            sync_subtitle.sync_between_times('00:10:00,000', '00:20:00,000', \
+                work_file, 1500))),
+        ('sync_after_index', with_copy(lambda: \
+            sync_subtitle.sync_after_index(100, work_file, 1500))),
+        ('sync_before_index', with_copy(lambda: \
+            sync_subtitle.sync_before_index(100, work_file, 1500))),
+        ('sync_between_indexes', with_copy(lambda: \
+            sync_subtitle.sync_between_indexes(100, 200, work_file, 1500))),
+        ('sync_in_place', with_copy(lambda: \
+            sync_subtitle.sync_in_place(work_file, 1500))),
+        ('sync_to_anchors', with_copy(lambda: \
+            sync_subtitle.sync_to_anchors([('00:10:00,000', '00:10:02,500'), \
+                ('01:05:00,000', '01:04:58,000')], work_file))),
+        ('sync_iter', sync_iter),
+        ('sync_stream', sync_stream),
+        ('sync_batch ({} files)'.format(BATCH_FILES), sync_batch),
+    ] + [
+        ('retime: ' + engine, retime(engine)) for engine in engines
+    ] + [
+        ('parse: get_start_and_end_times', parse_lines),
+        ('parse: SubtitleDocument', lambda: \
+            sync_subtitle.SubtitleDocument.from_file(input_file)),
+        ('parse: CueIndex.build', lambda: \
+            sync_subtitle.CueIndex.build(input_file)),
+        ('format: ms_to_str', format_times),
+        ('format: SubtitleDocument.to_string', document.to_string),
+    ]
+
+
+
+def run_benchmarks(sizes=(1000, 10000, 100000), crlf=False, repeat=3, \
+    memory=True, names=None):
+    """
+    Runs all the benchmarks on synthetic files of the given sizes and returns
+    the results as a JSON-serializable dict.
+
+        sizes                -- Numbers of cues of the synthetic files
+        crlf                 -- True for CRLF line endings
+        repeat               -- Number of timed runs (the best one is kept)
+        memory               -- Also measure the peak memory of each benchmark
+        names                -- Only run the benchmarks with these names
+    """
+    results = []
+    directory = tempfile.mkdtemp(prefix='sync_subtitle_bench_')
+    try:
+        for cue_count in sizes:
+            input_file = os.path.join(directory, 'input.srt')
+            work_file = os.path.join(directory, 'work.srt')
+            file_size = generate_srt(input_file, cue_count, crlf)
+            for name, function in _benchmarks(input_file, work_file):
+                if names and name not in names:
+                    continue
+                (seconds, peak) = _measure(function, repeat, memory)
+                results.append({
+                    'name': name,
+                    'cues': cue_count,
+                    'bytes': file_size,
+                    'seconds': seconds,
+                    'cues_per_second': cue_count / seconds if seconds else None,
+                    'mb_per_second': file_size / 1e6 / seconds \
+                        if seconds else None,
+                    'peak_memory_bytes': peak,
+                })
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'numpy': sync_subtitle.numpy is not None,
+        'crlf': crlf,
+        'repeat': repeat,
+        'results': results,
+    }
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(\
+        description='Benchmarks of the sync_subtitle module.')
+    parser.add_argument('--sizes', type=int, nargs='+', \
+        default=[1000, 10000, 100000], help='numbers of cues (up to 1000000)')
+    parser.add_argument('--crlf', action='store_true', \
+        help='generate files with CRLF line endings')
+    parser.add_argument('--repeat', type=int, default=3, \
+        help='number of timed runs of each benchmark')
+    parser.add_argument('--no-memory', action='store_true', \
+        help='do not measure peak memory')
+    parser.add_argument('--only', nargs='+', metavar='NAME', \
+        help='only run the benchmarks with these names')
+    parser.add_argument('-o', '--output', \
+        help='write the JSON results to this file instead of standard output')
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.crlf, args.repeat, \
+        not args.no_memory, args.only)
+    if args.output:
+        with open(args.output, 'w') as outputfile:
+            json.dump(report, outputfile, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,7 @@
 from distutils.core import setup
 setup(
     name = "sync_subtitle",
-    version = "2.1.0",
+    version = "2.2.0",
     py_modules = ['sync_subtitle'],
     author = "Prasannajit Acharya - Kanhu",
     author_email = "prasannajit.acharya.kanhu@gmail.com",
@@ -19,6 +19,78 @@ sync_before_index            -- Synchronizes the subtitles occuring before a
                                 specified index
 sync_between_indexes         -- Synchronizes the subtitles occuring between the
                                 specified starting and ending indexes
+sync_to_anchors              -- Retimes the subtitles through (source time ->
+                                target time) anchor points
+sync_batch                   -- Synchronizes the subtitle files found in
+                                directories and glob patterns on a process
+                                pool
+sync_in_place                -- Synchronizes a complete subtitle file by
+                                overwriting its timestamps in place
+sync_iter                    -- Yields the synchronized lines of a subtitle
+                                stream
+sync_stream                  -- Synchronizes a subtitle stream from one file
+                                object into another
+estimate_sync                -- Estimates the offset (and drift) of a subtitle
+                                file against a correctly timed one
+find_srt_files               -- Lists the subtitle files found in directories
+                                and glob patterns
+open_subtitle                -- Opens a subtitle file, compressed (.gz, .bz2,
+                                .xz) or not
+merge_tracks                 -- Merges subtitle tracks, each with its own
+                                offset, into one file
+read_srt_cues                -- Yields the cues of a SRT stream
+write_srt_cues               -- Yields the SRT lines of cues
+convert_subtitle             -- Converts a subtitle file between SRT, WebVTT
+                                and ASS/SSA while synchronizing it
+get_codec                    -- Returns the codec of a subtitle file
+serve                        -- Runs a SyncServer until interrupted
+pipeline_from_query          -- Returns the SyncPipeline described by a URL
+                                query string
+
+Classes:
+
+SubtitleDocument             -- A subtitle file parsed once into arrays, on
+                                which any number of synchronizations can be
+                                applied before it is saved
+SyncPipeline                 -- A queue of synchronizations applied to a file
+                                in a single pass
+TimeShift                    -- A single synchronization, optionally limited
+                                to a time or index range
+LinearRetime                 -- A linear retiming (scale and offset) for
+                                frame-rate conversion and drift correction
+AnchorRetime                 -- A piecewise-linear retiming through anchor
+                                points
+SyncStats                    -- Counters and stage timings of synchronizations
+AtomicFileWriter             -- Writes a file in large batches through a
+                                temporary file committed atomically
+CueTokenizer                 -- Tracks the cue boundaries of a file fed line
+                                by line
+CueRepair                    -- Reorders, trims, drops and renumbers cues in
+                                the synchronization pass
+SubtitleCache                -- LRU cache of parsed subtitles for long-running
+                                services
+IncrementalSyncer            -- Synchronizes a subtitle arriving in byte chunks
+AsyncSubtitleSyncer          -- asyncio counterparts of the sync functions,
+                                with a concurrency limit
+SyncServer                   -- HTTP synchronization service with a pool of
+                                pre-forked workers
+SyncWatcher                  -- Synchronizes the new and changed files of
+                                watched directories
+CueIndex                     -- Byte offsets of the cues of a file, kept in a
+                                sidecar file for random access
+BatchResult                  -- Result of synchronizing one file in a batch
+BatchSummary                 -- Per-file results of sync_batch()
+SyncEstimate                 -- Result of estimate_sync()
+Cue                          -- A cue read from a subtitle stream
+SubtitleCodec                -- Base class of the subtitle format readers and
+                                writers
+SrtCodec                     -- SubRip (.srt) codec
+WebVttCodec                  -- WebVTT (.vtt) codec
+AssCodec                     -- Advanced SubStation Alpha (.ass) codec
+SsaCodec                     -- SubStation Alpha v4 (.ssa) codec
+
+Run 'python -m sync_subtitle --help' to synchronize standard input into
+standard output.
 """
 
 """
@@ -44,14 +116,59 @@ THE SOFTWARE.
 
 """
 
+import argparse
+import asyncio
+import bisect
+import bz2
+import cmath
+import contextlib
+import glob
+import gzip
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
+import json
+import lzma
+import math
+import mmap
+import multiprocessing
+import numbers
 import os
 import re
+import shutil
+import signal
+import socketserver
+import struct
+import sys
+import threading
+import time
+import urllib.parse
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:         # NumPy is optional, pure Python is used without it
+    numpy = None
 
 __all__ = ['sync', 'sync_after_time', 'sync_before_time', 'sync_between_times',\
-            'sync_after_index', 'sync_before_index', 'sync_between_indexes']
-SUBTITLE_INDEX_FLAG = True
+            'sync_after_index', 'sync_before_index', 'sync_between_indexes',\
+            'sync_to_anchors', 'sync_batch', 'sync_in_place', 'sync_iter',\
+            'sync_stream', 'estimate_sync', 'find_srt_files', 'open_subtitle',\
+            'merge_tracks', 'read_srt_cues', 'write_srt_cues',\
+            'convert_subtitle', 'get_codec', 'SUBTITLE_CODECS', 'serve',\
+            'pipeline_from_query', 'SubtitleDocument', 'SyncPipeline',\
+            'TimeShift', 'LinearRetime', 'AnchorRetime', 'CueTokenizer',\
+            'CueRepair', 'IncrementalSyncer', 'AsyncSubtitleSyncer',\
+            'SubtitleCache', 'SyncStats', 'AtomicFileWriter', 'CueIndex',\
+            'BatchResult', 'BatchSummary', 'SyncServer', 'SyncWatcher',\
+            'SyncEstimate', 'Cue', 'SubtitleCodec', 'SrtCodec', 'WebVttCodec',\
+            'AssCodec', 'SsaCodec']
 
-def sync(input_file, sync_time_in_ms, delay=True, output_file=''):
+def sync(input_file, sync_time_in_ms, delay=True, output_file='', stats=None):
     """
     Synchronizes a complete subtitle file.
 
@@ -62,37 +179,22 @@ def sync(input_file, sync_time_in_ms, delay=True, output_file=''):
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
-        if output_file == '':
-            output_file = input_file
         try:
-            with open(input_file) as inputfile:
-                with open(output_file + '.tmp', 'w') as outputfile:
-                    for each_line in inputfile:
-
-                        (start_time, end_time) = \
-                            get_start_and_end_times(each_line)
-
-                        if (start_time != None) or (end_time != None):
-
-                            (start_time, end_time) = get_sync_times(\
-                                sync_time_in_ms, start_time, end_time, delay)
-
-                            print(ms_to_str(start_time) + ' --> ' + \
-                                ms_to_str(end_time), file=outputfile)
-
-                        else:
-                            print(each_line, end='', file=outputfile)
-            save_srt_file(input_file, output_file)
+            SyncPipeline().sync(sync_time_in_ms, delay).run(input_file, \
+                output_file, stats)
         except IOError as ioerr:
             print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_after_time(sync_after_time_str, input_file, sync_time_in_ms, \
-    delay=True, output_file=''):
+    delay=True, output_file='', stats=None):
     """
     Synchronizes the subtitles occuring after a specified time.
 
@@ -106,45 +208,25 @@ def sync_after_time(sync_after_time_str, input_file, sync_time_in_ms, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
-        if output_file == '':
-            output_file = input_file
-        if check_time_str_format(sync_after_time_str):
+        sync_after_time_in_ms = _checked_time_str_to_ms(sync_after_time_str)
+        if sync_after_time_in_ms is not None:
             try:
-                with open(input_file) as inputfile:
-                    with open(output_file + '.tmp', 'w') as outputfile:
-                        for each_line in inputfile:
-
-                            sync_after_time_in_ms = \
-                                str_to_ms(sync_after_time_str)
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-                                if sync_after_time_in_ms < start_time:
-
-                                    (start_time, end_time) = \
-                                        get_sync_times(sync_time_in_ms, \
-                                            start_time, end_time, delay)
-
-                                    print(ms_to_str(start_time) + ' --> ' + \
-                                        ms_to_str(end_time), file=outputfile)
-
-                                else:
-                                    print(each_line, end='', file=outputfile)
-                            else:
-                                print(each_line, end='', file=outputfile)
-                save_srt_file(input_file, output_file)
+                SyncPipeline().add(TimeShift(sync_time_in_ms, delay, \
+                    after_time_in_ms=sync_after_time_in_ms)).run(input_file, \
+                    output_file, stats)
             except IOError as ioerr:
                 print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_before_time(sync_before_time_str, input_file, sync_time_in_ms, \
-    delay=True, output_file=''):
+    delay=True, output_file='', stats=None):
     """
     Synchronizes the subtitles occuring before a specified time.
 
@@ -158,45 +240,25 @@ def sync_before_time(sync_before_time_str, input_file, sync_time_in_ms, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
-        if output_file == '':
-            output_file = input_file
-        if check_time_str_format(sync_before_time_str):
+        sync_before_time_in_ms = _checked_time_str_to_ms(sync_before_time_str)
+        if sync_before_time_in_ms is not None:
             try:
-                with open(input_file) as inputfile:
-                    with open(output_file + '.tmp', 'w') as outputfile:
-                        for each_line in inputfile:
-
-                            sync_before_time_in_ms = \
-                                str_to_ms(sync_before_time_str)
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-                                if sync_before_time_in_ms > end_time:
-
-                                    (start_time, end_time) = \
-                                        get_sync_times(sync_time_in_ms, \
-                                            start_time, end_time, delay)
-
-                                    print(ms_to_str(start_time) + ' --> ' + \
-                                        ms_to_str(end_time), file=outputfile)
-
-                                else:
-                                    print(each_line, end='', file=outputfile)
-                            else:
-                                print(each_line, end='', file=outputfile)
-                save_srt_file(input_file, output_file)
+                SyncPipeline().add(TimeShift(sync_time_in_ms, delay, \
+                    before_time_in_ms=sync_before_time_in_ms)).run(input_file, \
+                    output_file, stats)
             except IOError as ioerr:
                 print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_between_times(sync_after_time_str, sync_before_time_str, input_file, \
-    sync_time_in_ms, delay=True, output_file=''):
+    sync_time_in_ms, delay=True, output_file='', use_index=False, stats=None):
     """
     Synchronizes the subtitles occuring between the specified starting and
     ending times.
@@ -214,53 +276,43 @@ def sync_between_times(sync_after_time_str, sync_before_time_str, input_file, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        use_index            -- True to use (or build) the CueIndex sidecar
+                                of the input file and rewrite only the cues
+                                in the time range.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
         if output_file == '':
             output_file = input_file
 
-        if check_time_str_format(sync_after_time_str) and \
-            check_time_str_format(sync_before_time_str):
+        sync_after_time_in_ms = _checked_time_str_to_ms(sync_after_time_str)
+        sync_before_time_in_ms = None
+        if sync_after_time_in_ms is not None:
+            sync_before_time_in_ms = \
+                _checked_time_str_to_ms(sync_before_time_str)
 
+        if sync_before_time_in_ms is not None:
             try:
-                with open(input_file) as inputfile:
-                    with open(output_file + '.tmp', 'w') as outputfile:
-                        for each_line in inputfile:
-
-                            sync_after_time_in_ms = \
-                                str_to_ms(sync_after_time_str)
-
-                            sync_before_time_in_ms = \
-                                str_to_ms(sync_before_time_str)
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-
-                                if (sync_after_time_in_ms < start_time) and \
-                                    (sync_before_time_in_ms > end_time):
-
-                                    (start_time, end_time) = \
-                                        get_sync_times(sync_time_in_ms, \
-                                            start_time, end_time, delay)
-
-                                    print(ms_to_str(start_time) + ' --> ' + \
-                                        ms_to_str(end_time), file=outputfile)
-
-                                else:
-                                    print(each_line, end='', file=outputfile)
-                            else:
-                                print(each_line, end='', file=outputfile)
-                save_srt_file(input_file, output_file)
+                pipeline = SyncPipeline().add(TimeShift(sync_time_in_ms, \
+                    delay, after_time_in_ms=sync_after_time_in_ms, \
+                    before_time_in_ms=sync_before_time_in_ms))
+                if use_index and _compression(input_file) is None:
+                    cue_index = CueIndex.load_or_build(input_file)
+                    cue_index.sync_positions(cue_index.positions_between_times(\
+                        sync_after_time_in_ms, sync_before_time_in_ms), \
+                        pipeline, output_file, stats)
+                else:
+                    pipeline.run(input_file, output_file, stats)
             except IOError as ioerr:
                 print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_after_index(index, input_file, sync_time_in_ms, delay=True, \
-    output_file=''):
+    output_file='', stats=None):
     """
     Synchronizes the subtitles occuring after a specified index.
 
@@ -274,44 +326,22 @@ def sync_after_index(index, input_file, sync_time_in_ms, delay=True, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
-        if output_file == '':
-            output_file = input_file
         try:
-            with open(input_file) as inputfile:
-                with open(output_file + '.tmp', 'w') as outputfile:
-                    subtitle_index = 0
-                    for each_line in inputfile:
-                        if is_index(each_line):
-                            subtitle_index = int(each_line)
-                        if subtitle_index > index:
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-
-                                (start_time, end_time) = \
-                                    get_sync_times(sync_time_in_ms, start_time,\
-                                        end_time, delay)
-
-                                print(ms_to_str(start_time) + ' --> ' + \
-                                    ms_to_str(end_time), file=outputfile)
-
-                            else:
-                                print(each_line, end='', file=outputfile)
-                        else:
-                            print(each_line, end='', file=outputfile)
-            save_srt_file(input_file, output_file)
+            SyncPipeline().sync_after_index(index, sync_time_in_ms, delay) \
+                .run(input_file, output_file, stats)
         except IOError as ioerr:
             print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_before_index(index, input_file, sync_time_in_ms, delay=True, \
-    output_file=''):
+    output_file='', stats=None):
     """
     Synchronizes the subtitles occuring before a specified index.
 
@@ -323,44 +353,22 @@ def sync_before_index(index, input_file, sync_time_in_ms, delay=True, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
-        if output_file == '':
-            output_file = input_file
         try:
-            with open(input_file) as inputfile:
-                with open(output_file + '.tmp', 'w') as outputfile:
-                    subtitle_index = 0
-                    for each_line in inputfile:
-                        if is_index(each_line):
-                            subtitle_index = int(each_line)
-                        if subtitle_index < index:
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-
-                                (start_time, end_time) = \
-                                    get_sync_times(sync_time_in_ms, start_time,\
-                                        end_time, delay)
-
-                                print(ms_to_str(start_time) + ' --> ' + \
-                                    ms_to_str(end_time), file=outputfile)
-
-                            else:
-                                print(each_line, end='', file=outputfile)
-                        else:
-                            print(each_line, end='', file=outputfile)
-            save_srt_file(input_file, output_file)
+            SyncPipeline().sync_before_index(index, sync_time_in_ms, delay) \
+                .run(input_file, output_file, stats)
         except IOError as ioerr:
             print('File error: ' + str(ioerr))
+    return stats
 
 
 
 def sync_between_indexes(start_index, end_index, input_file, sync_time_in_ms, \
-    delay=True, output_file=''):
+    delay=True, output_file='', use_index=False, stats=None):
     """
     Synchronizes the subtitles occuring between the specified starting and
     ending times.
@@ -374,41 +382,28 @@ def sync_between_indexes(start_index, end_index, input_file, sync_time_in_ms, \
                                 hastening it.
         output_file          -- With default value input file will be replaced.
                                 Change it to get output in different file.
+        use_index            -- True to use (or build) the CueIndex sidecar
+                                of the input file and rewrite only the cues
+                                in the index range.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
     """
 
     if check_srt_extension(input_file):
         if output_file == '':
             output_file = input_file
         try:
-            with open(input_file) as inputfile:
-                with open(output_file + '.tmp', 'w') as outputfile:
-                    subtitle_index = 0
-                    for each_line in inputfile:
-                        if is_index(each_line):
-                            subtitle_index = int(each_line)
-
-                        if (subtitle_index > start_index) and (subtitle_index <\
-                            end_index):
-
-                            (start_time, end_time) = \
-                                get_start_and_end_times(each_line)
-
-                            if (start_time != None) or (end_time != None):
-
-                                (start_time, end_time) = \
-                                    get_sync_times(sync_time_in_ms, start_time,\
-                                        end_time, delay)
-
-                                print(ms_to_str(start_time) + ' --> ' + \
-                                    ms_to_str(end_time), file=outputfile)
-
-                            else:
-                                print(each_line, end='', file=outputfile)
-                        else:
-                            print(each_line, end='', file=outputfile)
-            save_srt_file(input_file, output_file)
+            pipeline = SyncPipeline().sync_between_indexes(start_index, \
+                end_index, sync_time_in_ms, delay)
+            if use_index and _compression(input_file) is None:
+                cue_index = CueIndex.load_or_build(input_file)
+                cue_index.sync_positions(cue_index.positions_between_indexes(\
+                    start_index, end_index), pipeline, output_file, stats)
+            else:
+                pipeline.run(input_file, output_file, stats)
         except IOError as ioerr:
             print('File error: ' + str(ioerr))
+    return stats
 
 
 
@@ -460,20 +455,46 @@ def get_sync_times(sync_time_in_ms, start_time, end_time, delay):
 
 
 
+def get_linear_sync_times(scale, offset_in_ms, start_time, end_time):
+    """
+    Returns the (start_time, end_time) of a cue retimed to
+    time * scale + offset_in_ms, rounded to the nearest millisecond.
+
+    The clamping rules of get_sync_times() apply to every time moved earlier:
+    a start time is kept if it would not stay positive, and an end time is
+    kept if it would not stay after the start time. With scale 1 this is the
+    same as get_sync_times().
+
+        scale                -- Speed factor, e.g. 23.976 / 25 for a PAL
+                                speed-up
+        offset_in_ms         -- Time (in millisecond) added after scaling,
+                                negative for hastening
+        start_time           -- Subtitle line start time (in millisecond)
+        end_time             -- Subtitle line end time (in millisecond)
+    """
+    new_start_time = int(math.floor(start_time * scale + offset_in_ms + 0.5))
+    if new_start_time < start_time and new_start_time <= 0:
+        new_start_time = start_time
+    new_end_time = int(math.floor(end_time * scale + offset_in_ms + 0.5))
+    if new_end_time < end_time and new_end_time <= new_start_time:
+        new_end_time = end_time
+    return (new_start_time, new_end_time)
+
+
+
 def save_srt_file(input_file, output_file):
     """
+    Replaces 'output_file' with 'output_file.tmp' in one atomic step, so the
+    subtitle never goes missing and readers see either the old or the new
+    file.
+
         input_file           -- Input subtitle file
         output_file          -- Output subtitle file
     """
-    if input_file == output_file:
-        try:
-            os.remove(input_file)
-        except NotImplementedError as nierr:
-            print('File modification error: ' + str(nierr))
     try:
-        os.rename(output_file + '.tmp', output_file)
-    except NotImplementedError as nierr:
-        print('File modification error: ' + str(nierr))
+        os.replace(output_file + '.tmp', output_file)
+    except OSError as oserr:
+        print('File modification error: ' + str(oserr))
 
 
 
@@ -504,11 +525,46 @@ def ms_to_str(time_in_ms):
 
 
 
+_COMPRESSIONS = {'.gz': gzip, '.bz2': bz2, '.xz': lzma}
+_SRT_EXTENSIONS = ('.srt', '.srt.gz', '.srt.bz2', '.srt.xz')
+
+
+
+def _compression(path):
+    """
+    Returns the module (gzip, bz2 or lzma) compressing a file, from its
+    extension, or None for an uncompressed file.
+    """
+    return _COMPRESSIONS.get(os.path.splitext(path)[1])
+
+
+
+def open_subtitle(path, mode='rb', **kwargs):
+    """
+    Opens a subtitle file like open(), compressing or decompressing it on the
+    fly when its name ends with .gz, .bz2 or .xz (e.g. movie.srt.gz), so
+    compressed files are streamed without an uncompressed copy.
+
+        path                 -- Path to the file
+        mode                 -- Mode, as for open()
+        kwargs               -- Other arguments of open() (encoding, errors,
+                                newline)
+    """
+    compression = _compression(path)
+    if compression is None:
+        return open(path, mode, **kwargs)
+    if 't' not in mode and 'b' not in mode:
+        mode += 'b'
+    return compression.open(path, mode, **kwargs)
+
+
+
 def check_srt_extension(input_file):
     """
         input_file           -- Input file to be checked for .srt extension
+                                (.srt.gz, .srt.bz2 and .srt.xz are accepted)
     """
-    if input_file.endswith('.srt'):
+    if input_file.endswith(_SRT_EXTENSIONS):
         return True
     else:
         print('Error: File needs to have .srt extension. Check the input file.')
@@ -530,19 +586,3867 @@ def check_time_str_format(time_str):
 
 
 
-def is_index(input_line):
+def _checked_time_str_to_ms(time_str):
     """
-        input_line           -- String to be check against time pattern to get
-                                start and end time
+    Converts a time string to millisecond the way the sync_*_time functions
+    always have: the string has to start with hh:mm:ss,ms, and the fields
+    are read by str_to_ms (so trailing spaces are allowed). Prints an error
+    and returns None otherwise.
+
+        time_str             -- Time string in (hh:mm:ss,ms) format
     """
-    global SUBTITLE_INDEX_FLAG
-    if SUBTITLE_INDEX_FLAG:
-        isindex = re.match(r'^[\d]+$', input_line)
-        if isindex:
-            SUBTITLE_INDEX_FLAG = False
-            return True
-    else:
-        isnewline = re.match(r'^\n', input_line)
-        if isnewline:
-            SUBTITLE_INDEX_FLAG = True
-    return False
+    if check_time_str_format(time_str):
+        try:
+            return str_to_ms(time_str)
+        except ValueError:
+            print('Error: Time string must be in the format of hh:mm:ss,ms' + \
+                '(01:23:45,678).')
+    return None
+
+
+
+class SyncStats(object):
+    """
+    Counters and per-stage wall times of synchronizations, for metrics and
+    for finding slow inputs without a profiler. Pass one as the 'stats'
+    argument of a sync function (the same object can collect several calls);
+    collecting them costs a few clock reads per line, so it is opt-in.
+
+        lines_scanned        -- Lines read
+        time_lines_matched   -- Timing lines found
+        cues_modified        -- Timing lines changed
+        bytes_read           -- Bytes read from the input
+        bytes_written        -- Bytes written to the output
+        files                -- Files committed
+        parse_time           -- Seconds spent reading and parsing lines
+        transform_time       -- Seconds spent applying the operations and
+                                formatting the changed timestamps
+        write_time           -- Seconds spent writing the output
+        commit_time          -- Seconds spent flushing the output and
+                                replacing the output file
+        cues_reordered       -- Cues moved back in start time order
+        overlaps_trimmed     -- Cues ended earlier to stop overlapping the
+                                next one
+        cues_dropped         -- Cues dropped for ending at or before their
+                                start
+        cues_renumbered      -- Cues given a new index
+
+        callback             -- Called with the stats object each time a
+                                file is committed
+    """
+    _COUNTERS = ('lines_scanned', 'time_lines_matched', 'cues_modified', \
+        'bytes_read', 'bytes_written', 'files', 'parse_time', \
+        'transform_time', 'write_time', 'commit_time', 'cues_reordered', \
+        'overlaps_trimmed', 'cues_dropped', 'cues_renumbered')
+    __slots__ = _COUNTERS + ('callback',)
+
+    def __init__(self, callback=None):
+        for name in self._COUNTERS:
+            setattr(self, name, 0)
+        self.callback = callback
+
+    def as_dict(self):
+        """
+        Returns the counters and stage times as a dict.
+        """
+        return dict((name, getattr(self, name)) for name in self._COUNTERS)
+
+    def committed(self):
+        """
+        Records a committed file and calls the callback.
+        """
+        self.files += 1
+        if self.callback is not None:
+            self.callback(self)
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(\
+            '{}={!r}'.format(name, getattr(self, name)) \
+            for name in self._COUNTERS))
+
+
+
+class CueTokenizer(object):
+    """
+    Tracks the cue boundaries of a SRT file fed line by line: an index line
+    is expected at the start of the file and after every blank line.
+
+    All the state lives in the instance, so every pass over a file uses its
+    own tokenizer and any number of passes can run concurrently.
+    """
+    __slots__ = ('subtitle_index', 'expect_index')
+
+    def __init__(self):
+        self.subtitle_index = 0
+        self.expect_index = True
+
+    def is_index(self, input_line):
+        """
+        Returns True if 'input_line' is the index line of a new cue, whose
+        index is then available as 'subtitle_index'.
+
+            input_line       -- Next line of the SRT file
+        """
+        if self.expect_index:
+            index_str = input_line.strip().lstrip('\ufeff')
+            if index_str.isdecimal():
+                self.subtitle_index = int(index_str)
+                self.expect_index = False
+                return True
+        elif not input_line.strip():
+            self.expect_index = True
+        return False
+
+    def is_index_bytes(self, input_line):
+        """
+        Same as is_index() for a line read in binary mode.
+
+            input_line       -- Next line of the SRT file, as bytes
+        """
+        if self.expect_index:
+            index_str = input_line.strip().lstrip(b'\xef\xbb\xbf')
+            if index_str.isdigit():
+                self.subtitle_index = int(index_str)
+                self.expect_index = False
+                return True
+        elif not input_line.strip():
+            self.expect_index = True
+        return False
+
+
+
+_TIME_LINE_PATTERN = re.compile(\
+    r'(\d{2}):(\d{2}):(\d{2}),(\d{3}) --> (\d{2}):(\d{2}):(\d{2}),(\d{3})')
+_TIME_LINE_BYTES_PATTERN = re.compile(\
+    rb'(\d{2}):(\d{2}):(\d{2}),(\d{3}) --> (\d{2}):(\d{2}):(\d{2}),(\d{3})')
+_TIME_LINE_WIDTH = 29
+_MAX_FIXED_WIDTH_TIME_IN_MS = 100 * 3600000 - 1
+_CUE_START_BYTES_PATTERN = re.compile(\
+    rb'\n[ \t]*\r?\n(\d+)[ \t]*\r?\n\d{2}:\d{2}:\d{2},\d{3} --> ')
+_INDEXED_TIME_LINE_BYTES_PATTERN = re.compile(\
+    rb'^(?:(?:\xef\xbb\xbf)?(\d+)[ \t]*\r?\n)?' \
+    rb'(\d{2}):(\d{2}):(\d{2}),(\d{3}) --> (\d{2}):(\d{2}):(\d{2}),(\d{3})', \
+    re.MULTILINE)
+
+
+
+def match_time_line(input_line):
+    """
+    Returns the (start_time, end_time) tuple (in millisecond) of a timing line,
+    or None if 'input_line' does not start with hh:mm:ss,ms --> hh:mm:ss,ms.
+
+    Unlike get_start_and_end_times(), the pattern is compiled once and the
+    fields are converted straight from the match groups.
+
+        input_line           -- String to be checked against time pattern
+    """
+    match = _TIME_LINE_PATTERN.match(input_line)
+    if match is None:
+        return None
+    (sh, sm, ss, sms, eh, em, es, ems) = match.groups()
+    return ((int(sh) * 3600 + int(sm) * 60 + int(ss)) * 1000 + int(sms),
+            (int(eh) * 3600 + int(em) * 60 + int(es)) * 1000 + int(ems))
+
+
+
+def time_str_to_ms(time_str):
+    """
+    Converts a time string in (hh:mm:ss,ms) format to millisecond. Raises
+    ValueError instead of printing an error if the format is wrong.
+
+        time_str             -- Time string in (hh:mm:ss,ms) format
+    """
+    if re.match(r'\d{2}:\d{2}:\d{2},\d{3}$', time_str) is None:
+        raise ValueError('Time string must be in the format of hh:mm:ss,ms' + \
+            ' (01:23:45,678): ' + repr(time_str))
+    return str_to_ms(time_str)
+
+
+
+def _time_in_ms(time):
+    """
+    Returns a time given in millisecond, or as a hh:mm:ss,ms string, in
+    millisecond.
+    """
+    if isinstance(time, str):
+        return time_str_to_ms(time)
+    return int(time)
+
+
+
+class SubtitleDocument(object):
+    """
+    A subtitle (SRT) file parsed once into compact parallel arrays.
+
+    Cue start and end times (in millisecond) and cue indexes are kept in
+    array('q') columns. Everything that is not a timestamp (index lines, text,
+    blank lines, anything before the first cue) lives in one shared text
+    buffer; 'text_offsets[i]' is the position in that buffer where the
+    timestamps of cue i are written back. Any number of shift operations can
+    be applied to a loaded document without re-reading or re-parsing it, and
+    serializing it reproduces every untouched character of the input.
+
+    A cue without an index line gets the index -1.
+
+        lines                -- Iterable of lines (with line endings) of a SRT
+                                file.
+    """
+
+    def __init__(self, lines=()):
+        self.start_times = array('q')
+        self.end_times = array('q')
+        self.indexes = array('q')
+        self.text_offsets = array('q')
+        self.text = ''
+        self._parse(lines)
+
+    @classmethod
+    def from_file(cls, input_file):
+        """
+        Parses a SRT file into a new document.
+
+            input_file       -- Path to the input SRT file.
+        """
+        with open_subtitle(input_file, 'rt', encoding='utf-8', \
+            errors='surrogateescape', newline='') as inputfile:
+            return cls(inputfile)
+
+    @classmethod
+    def from_string(cls, srt_text):
+        """
+            srt_text         -- Content of a SRT file as a string
+        """
+        return cls(io.StringIO(srt_text, newline=''))
+
+    @classmethod
+    def from_bytes(cls, srt_data):
+        """
+            srt_data         -- Content of a SRT file as bytes (any ASCII
+                                compatible encoding is kept by to_bytes())
+        """
+        return cls.from_string(srt_data.decode('utf-8', 'surrogateescape'))
+
+    def copy(self):
+        """
+        Returns an independent copy of the document. The arrays are copied;
+        the text buffer is immutable and shared.
+        """
+        document = type(self)()
+        document.start_times = array('q', self.start_times)
+        document.end_times = array('q', self.end_times)
+        document.indexes = array('q', self.indexes)
+        document.text_offsets = array('q', self.text_offsets)
+        document.text = self.text
+        return document
+
+    def _parse(self, lines):
+        chunks = []
+        size = 0
+        previous_line = ''
+        for each_line in lines:
+            times = match_time_line(each_line)
+            if times is None:
+                chunks.append(each_line)
+                size += len(each_line)
+                previous_line = each_line
+                continue
+            index = previous_line.strip().lstrip('\ufeff')
+            self.indexes.append(int(index) if index.isdecimal() else -1)
+            self.start_times.append(times[0])
+            self.end_times.append(times[1])
+            self.text_offsets.append(size)
+            rest = each_line[_TIME_LINE_WIDTH:]
+            chunks.append(rest)
+            size += len(rest)
+            previous_line = each_line
+        self.text = ''.join(chunks)
+
+    def __len__(self):
+        return len(self.start_times)
+
+    def __iter__(self):
+        """
+        Yields (index, start_time, end_time) of every cue.
+        """
+        return zip(self.indexes, self.start_times, self.end_times)
+
+    def cue_text(self, position):
+        """
+        Returns the text lines of the cue at 'position' (0 based position in
+        the document, not the SRT index), including the trailing blank line.
+
+            position         -- Position of the cue in the document
+        """
+        begin = self.text_offsets[position]
+        if position + 1 < len(self.text_offsets):
+            end = self.text_offsets[position + 1]
+        else:
+            end = len(self.text)
+        segment = self.text[begin:end]
+        segment = segment[segment.find('\n') + 1:] if '\n' in segment else ''
+        if position + 1 < len(self.indexes) and \
+            self.indexes[position + 1] != -1:
+            # Strip the index line of the next cue
+            segment = segment[:segment.rfind('\n', 0, len(segment) - 1) + 1]
+        return segment
+
+    def find_index(self, index):
+        """
+        Returns the position of the first cue having SRT index 'index', or -1.
+
+            index            -- SRT index of the cue
+        """
+        try:
+            return self.indexes.index(index)
+        except ValueError:
+            return -1
+
+    def positions_between_times(self, after_time_in_ms=None, \
+        before_time_in_ms=None):
+        """
+        Returns the positions of the cues starting after 'after_time_in_ms'
+        and ending before 'before_time_in_ms', with the same comparisons as
+        sync_between_times(). Either bound can be None.
+
+            after_time_in_ms -- Time (in millisecond) after which cues start
+            before_time_in_ms
+                             -- Time (in millisecond) before which cues end
+        """
+        return [position for position, (start_time, end_time) in \
+            enumerate(zip(self.start_times, self.end_times)) \
+            if (after_time_in_ms is None or after_time_in_ms < start_time) and \
+                (before_time_in_ms is None or before_time_in_ms > end_time)]
+
+    def positions_between_indexes(self, start_index=None, end_index=None):
+        """
+        Returns the positions of the cues whose SRT index is greater than
+        'start_index' and smaller than 'end_index', with the same comparisons
+        as sync_between_indexes(). Either bound can be None.
+
+            start_index      -- Index after which cues are selected
+            end_index        -- Index before which cues are selected
+        """
+        return [position for position, index in enumerate(self.indexes) \
+            if (start_index is None or index > start_index) and \
+                (end_index is None or index < end_index)]
+
+    def shift_positions(self, positions, sync_time_in_ms, delay=True):
+        """
+        Delays, or hastens the cues at the given positions. Returns the number
+        of cues shifted.
+
+            positions        -- Iterable of cue positions (e.g. a range)
+            sync_time_in_ms  -- Time (in millisecond) for which cues will be
+                                delayed, or hastened.
+            delay            -- True for delaying the cues, False for
+                                hastening them.
+        """
+        start_times, end_times = self.start_times, self.end_times
+        count = 0
+        for position in positions:
+            (start_times[position], end_times[position]) = get_sync_times(\
+                sync_time_in_ms, start_times[position], end_times[position], \
+                delay)
+            count += 1
+        return count
+
+    def sync(self, sync_time_in_ms, delay=True):
+        """
+        Synchronizes all the cues. Returns the number of cues shifted.
+
+            sync_time_in_ms  -- Time (in millisecond) for which cues will be
+                                delayed, or hastened.
+            delay            -- True for delaying the cues, False for
+                                hastening them.
+        """
+        return self.retime(1, sync_time_in_ms if delay else -sync_time_in_ms)
+
+    def retime(self, scale=1, offset_in_ms=0, engine=None):
+        """
+        Retimes all the cues to time * scale + offset_in_ms, with the
+        clamping rules of get_linear_sync_times(). Returns the number of cues
+        changed.
+
+            scale            -- Speed factor (1 for a plain offset)
+            offset_in_ms     -- Time (in millisecond) added after scaling,
+                                negative for hastening
+            engine           -- 'numpy' for the vectorized engine, 'python'
+                                for the scalar one. By default NumPy is used
+                                if it is installed.
+        """
+        if engine is None:
+            engine = 'python' if numpy is None else 'numpy'
+        if engine == 'numpy':
+            return self._retime_numpy(scale, offset_in_ms)
+        if engine != 'python':
+            raise ValueError('Unknown engine: ' + repr(engine))
+
+        start_times, end_times = self.start_times, self.end_times
+        count = 0
+        for position in range(len(start_times)):
+            times = (start_times[position], end_times[position])
+            (start_time, end_time) = get_linear_sync_times(scale, \
+                offset_in_ms, times[0], times[1])
+            if (start_time, end_time) != times:
+                start_times[position] = start_time
+                end_times[position] = end_time
+                count += 1
+        return count
+
+    def _retime_numpy(self, scale, offset_in_ms):
+        if not len(self):
+            return 0
+        start_times = numpy.frombuffer(self.start_times, dtype=numpy.int64)
+        end_times = numpy.frombuffer(self.end_times, dtype=numpy.int64)
+        # Same operations in the same order as get_linear_sync_times(), so
+        # that both engines round alike
+        new_start_times = numpy.floor(start_times * float(scale) + \
+            offset_in_ms + 0.5).astype(numpy.int64)
+        new_start_times = numpy.where((new_start_times < start_times) & \
+            (new_start_times <= 0), start_times, new_start_times)
+        new_end_times = numpy.floor(end_times * float(scale) + \
+            offset_in_ms + 0.5).astype(numpy.int64)
+        new_end_times = numpy.where((new_end_times < end_times) & \
+            (new_end_times <= new_start_times), end_times, new_end_times)
+        count = int(numpy.count_nonzero((new_start_times != start_times) | \
+            (new_end_times != end_times)))
+        start_times[:] = new_start_times
+        end_times[:] = new_end_times
+        return count
+
+    def convert_frame_rate(self, from_fps, to_fps, engine=None):
+        """
+        Retimes all the cues for a video played at another frame rate, e.g.
+        convert_frame_rate(23.976, 25) for a PAL speed-up. Returns the number
+        of cues changed.
+
+            from_fps         -- Frame rate the subtitle is timed for
+            to_fps           -- Frame rate of the target video
+        """
+        return self.retime(float(from_fps) / to_fps, 0, engine)
+
+    def sync_after_time(self, sync_after_time_str, sync_time_in_ms, \
+        delay=True):
+        """
+        Synchronizes the cues occuring after a specified time (hh:mm:ss,ms).
+        """
+        return self.shift_positions(self.positions_between_times(\
+            time_str_to_ms(sync_after_time_str), None), sync_time_in_ms, delay)
+
+    def sync_before_time(self, sync_before_time_str, sync_time_in_ms, \
+        delay=True):
+        """
+        Synchronizes the cues occuring before a specified time (hh:mm:ss,ms).
+        """
+        return self.shift_positions(self.positions_between_times(None, \
+            time_str_to_ms(sync_before_time_str)), sync_time_in_ms, delay)
+
+    def sync_between_times(self, sync_after_time_str, sync_before_time_str, \
+        sync_time_in_ms, delay=True):
+        """
+        Synchronizes the cues occuring between the specified starting and
+        ending times (hh:mm:ss,ms).
+        """
+        return self.shift_positions(self.positions_between_times(\
+            time_str_to_ms(sync_after_time_str), \
+            time_str_to_ms(sync_before_time_str)), sync_time_in_ms, delay)
+
+    def sync_after_index(self, index, sync_time_in_ms, delay=True):
+        """
+        Synchronizes the cues occuring after a specified index.
+        """
+        return self.shift_positions(self.positions_between_indexes(index, \
+            None), sync_time_in_ms, delay)
+
+    def sync_before_index(self, index, sync_time_in_ms, delay=True):
+        """
+        Synchronizes the cues occuring before a specified index.
+        """
+        return self.shift_positions(self.positions_between_indexes(None, \
+            index), sync_time_in_ms, delay)
+
+    def sync_between_indexes(self, start_index, end_index, sync_time_in_ms, \
+        delay=True):
+        """
+        Synchronizes the cues occuring between the specified starting and
+        ending indexes.
+        """
+        return self.shift_positions(self.positions_between_indexes(\
+            start_index, end_index), sync_time_in_ms, delay)
+
+    def apply(self, operations):
+        """
+        Applies a SyncPipeline (or any iterable of operations having an
+        apply(index, start_time, end_time) method) to every cue. Returns the
+        number of cues changed. A SyncPipeline having a repair stage is
+        refused with ValueError: the stage works on the lines of a whole file.
+
+            operations       -- SyncPipeline, or list of operations
+        """
+        if getattr(operations, 'repair_options', None) is not None:
+            raise ValueError('A repair stage needs the whole file; use ' \
+                'SyncPipeline.run() instead.')
+        operations = list(operations)
+        start_times, end_times = self.start_times, self.end_times
+        count = 0
+        for position, index in enumerate(self.indexes):
+            start_time = start_times[position]
+            end_time = end_times[position]
+            for operation in operations:
+                (start_time, end_time) = \
+                    operation.apply(index, start_time, end_time)
+            if start_time != start_times[position] or \
+                end_time != end_times[position]:
+                start_times[position] = start_time
+                end_times[position] = end_time
+                count += 1
+        return count
+
+    def iter_chunks(self):
+        """
+        Yields the serialized document piece by piece.
+        """
+        text, offsets = self.text, self.text_offsets
+        previous_offset = 0
+        time_lines = _format_time_lines_numpy(self.start_times, self.end_times)
+        if time_lines is not None:
+            width = _TIME_LINE_WIDTH
+            for position, offset in enumerate(offsets):
+                yield text[previous_offset:offset]
+                yield time_lines[position * width:(position + 1) * width]
+                previous_offset = offset
+        else:
+            for offset, start_time, end_time in \
+                zip(offsets, self.start_times, self.end_times):
+                yield text[previous_offset:offset]
+                yield ms_to_str(start_time) + ' --> ' + ms_to_str(end_time)
+                previous_offset = offset
+        yield text[previous_offset:]
+
+    def to_string(self):
+        """
+        Returns the document serialized back to SRT.
+        """
+        return ''.join(self.iter_chunks())
+
+    def to_bytes(self):
+        """
+        Returns the document serialized back to SRT, as bytes.
+        """
+        return self.to_string().encode('utf-8', 'surrogateescape')
+
+    def write(self, outputfile):
+        """
+            outputfile       -- Text file object the SRT is written to
+        """
+        outputfile.writelines(self.iter_chunks())
+
+    def save(self, output_file, fsync=False):
+        """
+        Writes the document to 'output_file' with an AtomicFileWriter, so an
+        existing file is only replaced once the new content is complete.
+
+            output_file      -- Path to the output SRT file.
+            fsync            -- True to flush the output to disk before
+                                returning
+        """
+        with AtomicFileWriter(output_file, fsync) as writer:
+            writer.writelines(chunk.encode('utf-8', 'surrogateescape') \
+                for chunk in self.iter_chunks())
+
+
+
+def _format_time_lines_numpy(start_times, end_times):
+    """
+    Formats all the 'hh:mm:ss,ms --> hh:mm:ss,ms' timestamps at once with
+    NumPy and returns them concatenated in one string, or None if NumPy is
+    not installed or a time does not fit the fixed width.
+
+        start_times          -- array('q') of start times (in millisecond)
+        end_times            -- array('q') of end times (in millisecond)
+    """
+    if numpy is None or not len(start_times):
+        return None
+    columns = numpy.empty((len(start_times), _TIME_LINE_WIDTH), \
+        dtype=numpy.uint8)
+    columns[:, 12:17] = numpy.frombuffer(b' --> ', dtype=numpy.uint8)
+    for first_column, times in ((0, start_times), (17, end_times)):
+        times = numpy.frombuffer(times, dtype=numpy.int64)
+        if times.min() < 0 or times.max() > _MAX_FIXED_WIDTH_TIME_IN_MS:
+            return None
+        (hours, times) = numpy.divmod(times, 3600000)
+        (minutes, times) = numpy.divmod(times, 60000)
+        (seconds, milliseconds) = numpy.divmod(times, 1000)
+        for column, digits in ((0, hours // 10), (1, hours % 10), \
+            (3, minutes // 10), (4, minutes % 10), (6, seconds // 10), \
+            (7, seconds % 10), (9, milliseconds // 100), \
+            (10, milliseconds // 10 % 10), (11, milliseconds % 10)):
+            columns[:, first_column + column] = digits + 48
+        columns[:, first_column + 2] = ord(':')
+        columns[:, first_column + 5] = ord(':')
+        columns[:, first_column + 8] = ord(',')
+    return columns.tobytes().decode('ascii')
+
+
+
+class TimeShift(object):
+    """
+    A single synchronization: delays, or hastens the cues that match the
+    optional time and index bounds, with the same comparisons and clamping
+    as the sync_* functions.
+
+        sync_time_in_ms      -- Time (in millisecond) for which subtitle will
+                                be delayed, or hastened.
+        delay                -- True for delaying the subtitle, False for
+                                hastening it.
+        after_time_in_ms     -- Only cues starting after this time
+        before_time_in_ms    -- Only cues ending before this time
+        after_index          -- Only cues with an index greater than this
+        before_index         -- Only cues with an index smaller than this
+    """
+
+    def __init__(self, sync_time_in_ms, delay=True, after_time_in_ms=None, \
+        before_time_in_ms=None, after_index=None, before_index=None):
+        self.sync_time_in_ms = sync_time_in_ms
+        self.delay = delay
+        self.after_time_in_ms = after_time_in_ms
+        self.before_time_in_ms = before_time_in_ms
+        self.after_index = after_index
+        self.before_index = before_index
+
+    def matches(self, index, start_time, end_time):
+        """
+        Returns True if the cue falls inside the bounds of this shift.
+        """
+        return (self.after_time_in_ms is None or \
+                self.after_time_in_ms < start_time) and \
+            (self.before_time_in_ms is None or \
+                self.before_time_in_ms > end_time) and \
+            (self.after_index is None or index > self.after_index) and \
+            (self.before_index is None or index < self.before_index)
+
+    def apply(self, index, start_time, end_time):
+        """
+        Returns the (start_time, end_time) of the cue after this shift.
+
+            index            -- SRT index of the cue
+            start_time       -- Cue start time (in millisecond)
+            end_time         -- Cue end time (in millisecond)
+        """
+        if self.matches(index, start_time, end_time):
+            return get_sync_times(self.sync_time_in_ms, start_time, end_time, \
+                self.delay)
+        return (start_time, end_time)
+
+    def __repr__(self):
+        return '{}({!r}, delay={!r}, after_time_in_ms={!r}, ' \
+            'before_time_in_ms={!r}, after_index={!r}, before_index={!r})' \
+            .format(type(self).__name__, self.sync_time_in_ms, self.delay, \
+                self.after_time_in_ms, self.before_time_in_ms, \
+                self.after_index, self.before_index)
+
+
+
+class LinearRetime(TimeShift):
+    """
+    A linear retiming (time * scale + offset_in_ms) of the cues that match the
+    optional time and index bounds, for frame-rate conversion and drift
+    correction. See get_linear_sync_times() for the clamping rules.
+
+        scale                -- Speed factor, e.g. 23.976 / 25 for a PAL
+                                speed-up
+        offset_in_ms         -- Time (in millisecond) added after scaling,
+                                negative for hastening
+        after_time_in_ms     -- Only cues starting after this time
+        before_time_in_ms    -- Only cues ending before this time
+        after_index          -- Only cues with an index greater than this
+        before_index         -- Only cues with an index smaller than this
+    """
+
+    def __init__(self, scale=1, offset_in_ms=0, after_time_in_ms=None, \
+        before_time_in_ms=None, after_index=None, before_index=None):
+        TimeShift.__init__(self, abs(offset_in_ms), offset_in_ms >= 0, \
+            after_time_in_ms, before_time_in_ms, after_index, before_index)
+        self.scale = scale
+        self.offset_in_ms = offset_in_ms
+
+    def apply(self, index, start_time, end_time):
+        if self.matches(index, start_time, end_time):
+            return get_linear_sync_times(self.scale, self.offset_in_ms, \
+                start_time, end_time)
+        return (start_time, end_time)
+
+    def __repr__(self):
+        return '{}({!r}, offset_in_ms={!r}, after_time_in_ms={!r}, ' \
+            'before_time_in_ms={!r}, after_index={!r}, before_index={!r})' \
+            .format(type(self).__name__, self.scale, self.offset_in_ms, \
+                self.after_time_in_ms, self.before_time_in_ms, \
+                self.after_index, self.before_index)
+
+
+
+class AnchorRetime(object):
+    """
+    A piecewise-linear retiming through (source time -> target time) anchor
+    points, for subtitles that need different offsets in different regions
+    (cut scenes, other editions). Between two anchors the offset changes
+    linearly; before the first and after the last anchor their offset is
+    kept. The segment of each time is found with a binary search, so a cue
+    costs O(log k) for k anchors. See get_linear_sync_times() for the
+    clamping rules.
+
+        anchors              -- Iterable of (source_time, target_time) pairs,
+                                each time in millisecond or as a hh:mm:ss,ms
+                                string
+    """
+
+    def __init__(self, anchors):
+        anchors = sorted((_time_in_ms(source_time), _time_in_ms(target_time)) \
+            for source_time, target_time in anchors)
+        if not anchors:
+            raise ValueError('At least one anchor is needed.')
+        self.source_times = [source_time for source_time, _ in anchors]
+        self.target_times = [target_time for _, target_time in anchors]
+        for previous_time, source_time in \
+            zip(self.source_times, self.source_times[1:]):
+            if previous_time == source_time:
+                raise ValueError('Two anchors have the same source time: ' + \
+                    ms_to_str(source_time))
+        self._slopes = [float(next_target - target) / (next_source - source) \
+            for source, next_source, target, next_target in \
+            zip(self.source_times, self.source_times[1:], \
+                self.target_times, self.target_times[1:])]
+
+    def retime(self, time_in_ms):
+        """
+        Returns the target time (in millisecond) of a source time.
+        """
+        segment = bisect.bisect_right(self.source_times, time_in_ms) - 1
+        if segment < 0:
+            return time_in_ms + self.target_times[0] - self.source_times[0]
+        if segment >= len(self._slopes):
+            return time_in_ms + self.target_times[-1] - self.source_times[-1]
+        return int(math.floor(self.target_times[segment] + (time_in_ms - \
+            self.source_times[segment]) * self._slopes[segment] + 0.5))
+
+    def apply(self, index, start_time, end_time):
+        new_start_time = self.retime(start_time)
+        if new_start_time < start_time and new_start_time <= 0:
+            new_start_time = start_time
+        new_end_time = self.retime(end_time)
+        if new_end_time < end_time and new_end_time <= new_start_time:
+            new_end_time = end_time
+        return (new_start_time, new_end_time)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, \
+            list(zip(self.source_times, self.target_times)))
+
+
+
+class AtomicFileWriter(object):
+    """
+    Writes a file through a temporary file created next to it, and commits
+    it with one atomic os.replace(): the file never goes missing, readers
+    that opened the old file keep reading it, and an error or a cancelled
+    write leaves the old file untouched. Lines are gathered and written in
+    large batches instead of one write per line. A file named *.gz, *.bz2 or
+    *.xz is compressed on the fly.
+
+    Use it as a context manager; the file is committed when the block ends
+    without an exception, and discarded otherwise:
+
+        with AtomicFileWriter('movie.srt') as writer:
+            writer.writelines(lines)
+
+        output_file          -- Path to the file to be written
+        fsync                -- True to flush the data (and the directory
+                                entry) to disk before returning
+        buffer_size          -- Size (in bytes) of the write batches
+    """
+
+    def __init__(self, output_file, fsync=False, buffer_size=1 << 20):
+        self.output_file = output_file
+        self.fsync = fsync
+        self.buffer_size = buffer_size
+        self.temp_file = None
+        self.file = None
+        self.raw_file = None
+
+    def open(self):
+        """
+        Creates the temporary file. Called by the 'with' statement.
+        """
+        directory = os.path.dirname(os.path.abspath(self.output_file))
+        prefix = '.' + os.path.basename(self.output_file) + '.'
+        for attempt in itertools.count():
+            self.temp_file = os.path.join(directory, '{}{}.{}.tmp'.format(\
+                prefix, os.getpid(), os.urandom(4).hex()))
+            try:
+                # 0o666 lets the umask decide, as open() does
+                fd = os.open(self.temp_file, \
+                    os.O_WRONLY | os.O_CREAT | os.O_EXCL | \
+                    getattr(os, 'O_BINARY', 0), 0o666)
+                break
+            except FileExistsError:
+                if attempt > 100:
+                    raise
+        self.raw_file = self.file = io.open(fd, 'wb', \
+            buffering=self.buffer_size)
+        compression = _compression(self.output_file)
+        if compression is not None:
+            self.file = compression.open(self.raw_file, 'wb')
+        return self
+
+    def write(self, data):
+        """
+        Writes bytes to the temporary file.
+        """
+        self.file.write(data)
+
+    def writelines(self, lines, stats=None):
+        """
+        Writes an iterable of byte strings in batches of about 'buffer_size'
+        bytes. The time spent writing and the number of bytes (before any
+        compression) are added to 'stats' if given.
+        """
+        buffer_size = self.buffer_size
+        batch = []
+        batch_size = 0
+        for each_line in lines:
+            batch.append(each_line)
+            batch_size += len(each_line)
+            if batch_size >= buffer_size:
+                self._write_batch(batch, stats)
+                batch = []
+                batch_size = 0
+        if batch:
+            self._write_batch(batch, stats)
+
+    def _write_batch(self, batch, stats):
+        if stats is None:
+            self.file.write(b''.join(batch))
+        else:
+            started = time.perf_counter()
+            data = b''.join(batch)
+            self.file.write(data)
+            stats.write_time += time.perf_counter() - started
+            stats.bytes_written += len(data)
+
+    def commit(self):
+        """
+        Flushes the temporary file and atomically replaces the output file
+        with it, keeping the permissions of the replaced file. If that fails,
+        the temporary file is discarded and the error raised.
+        """
+        try:
+            if self.file is not self.raw_file:
+                self.file.close()   # Writes the end of the compressed stream
+            self.raw_file.flush()
+            if self.fsync:
+                os.fsync(self.raw_file.fileno())
+            self.raw_file.close()
+            try:
+                shutil.copymode(self.output_file, self.temp_file)
+            except OSError:
+                pass                # No file to replace yet
+            os.replace(self.temp_file, self.output_file)
+        except BaseException:
+            self.abort()
+            raise
+        self.temp_file = None
+        if self.fsync and hasattr(os, 'O_DIRECTORY'):
+            fd = os.open(os.path.dirname(os.path.abspath(self.output_file)), \
+                os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def abort(self):
+        """
+        Discards the temporary file; the output file is left untouched.
+        """
+        if self.file is not None:
+            for each_file in (self.file, self.raw_file):
+                try:
+                    each_file.close()
+                except OSError:
+                    pass        # Already failing; the file is removed anyway
+        if self.temp_file is not None:
+            try:
+                os.remove(self.temp_file)
+            except OSError:
+                pass
+            self.temp_file = None
+
+    def __enter__(self):
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+
+
+class CueRepair(object):
+    """
+    Repairs the cues of a synchronized SRT stream fed line by line, in the
+    same pass as the synchronization: cues are put back in start time order
+    through a heap of 'window' cues (so a cue can move up to 'window'
+    positions, in bounded memory), overlaps are trimmed by ending a cue when
+    the next one starts (unless both start together), cues of zero or
+    negative length are dropped, and the cues are renumbered from 1. What
+    was changed is counted in 'stats'.
+
+    All the state lives in the instance, so every pass uses its own;
+    SyncPipeline.repair() queues the stage on a pipeline.
+
+        renumber             -- Renumber the cues from 1
+        window               -- Number of cues held for reordering, 0 not to
+                                reorder
+        trim_overlaps        -- End a cue when the next one starts
+        drop_empty           -- Drop the cues ending at or before their start
+        stats                -- SyncStats collecting the repair counters
+    """
+
+    def __init__(self, renumber=True, window=64, trim_overlaps=True, \
+        drop_empty=True, stats=None):
+        self.renumber = renumber
+        self.window = window
+        self.trim_overlaps = trim_overlaps
+        self.drop_empty = drop_empty
+        self.stats = stats if stats is not None else SyncStats()
+        self.tokenizer = CueTokenizer()
+        # A cue is a list [start_time, end_time, sequence, times read, index,
+        # index line, timing line, text lines], ordered in the heap by start
+        # time and arrival
+        self.cue = None
+        self.last_cue = None
+        self.heap = []
+        self.held = None
+        self.sequence = 0
+        self.next_sequence = 0      # First cue not released yet
+        self.released = set()       # Cues released ahead of it
+        self.output_index = 0
+        self.newline = b'\n'
+
+    def feed(self, input_line):
+        """
+        Returns the list of repaired lines that can be written once
+        'input_line' (a byte line, with its line ending) is received.
+        """
+        tokenizer = self.tokenizer
+        if tokenizer.is_index_bytes(input_line):
+            output = self._end_cue()
+            if input_line.startswith(b'\xef\xbb\xbf'):
+                output.append(b'\xef\xbb\xbf')
+                input_line = input_line[3:]
+            if input_line.endswith(b'\r\n'):
+                self.newline = b'\r\n'
+            self.cue = [None, None, None, None, tokenizer.subtitle_index, \
+                input_line, None, []]
+            return output
+
+        cue = self.cue
+        if cue is None or cue[6] is None:
+            match = _TIME_LINE_BYTES_PATTERN.match(input_line)
+            if match is not None:
+                if cue is None:
+                    # A cue without index line
+                    cue = self.cue = [None, None, None, None, None, None, \
+                        None, []]
+                (sh, sm, ss, sms, eh, em, es, ems) = match.groups()
+                cue[0] = (int(sh) * 3600 + int(sm) * 60 + int(ss)) * 1000 + \
+                    int(sms)
+                cue[1] = (int(eh) * 3600 + int(em) * 60 + int(es)) * 1000 + \
+                    int(ems)
+                cue[3] = (cue[0], cue[1])
+                cue[6] = input_line
+                return []
+        if cue is None:
+            # Extra blank lines stay with the cue they follow
+            if self.last_cue is None:
+                return [input_line]
+            self.last_cue[7].append(input_line)
+            return []
+        cue[7].append(input_line)
+        if not input_line.strip():
+            return self._end_cue()
+        return []
+
+    def close(self):
+        """
+        Returns the lines of the cues still held.
+        """
+        output = self._end_cue()
+        while self.heap:
+            output.extend(self._release(heapq.heappop(self.heap)[2]))
+        if self.held is not None:
+            output.extend(self._format(self.held, True))
+            self.held = None
+        self.last_cue = None
+        return output
+
+    def repair_byte_lines(self, lines):
+        """
+        Yields the repaired lines of an iterable of byte lines.
+        """
+        for each_line in lines:
+            yield from self.feed(each_line)
+        yield from self.close()
+
+    def _end_cue(self):
+        cue = self.cue
+        self.cue = None
+        if cue is None:
+            return []
+        if cue[6] is None:
+            # Not a cue after all, e.g. a number alone in a text line
+            return [cue[5]] + cue[7]
+        self.last_cue = cue
+        if self.drop_empty and cue[1] <= cue[0]:
+            self.stats.cues_dropped += 1
+            return []
+        cue[2] = self.sequence
+        self.sequence += 1
+        heapq.heappush(self.heap, (cue[0], cue[2], cue))
+        if len(self.heap) > self.window:
+            return self._release(heapq.heappop(self.heap)[2])
+        return []
+
+    def _release(self, cue):
+        if cue[2] == self.next_sequence:
+            self.next_sequence += 1
+            while self.next_sequence in self.released:
+                self.released.remove(self.next_sequence)
+                self.next_sequence += 1
+        else:
+            self.stats.cues_reordered += 1
+            self.released.add(cue[2])
+        held = self.held
+        self.held = cue
+        if held is None:
+            return []
+        # Cues starting together are shown together, not trimmed
+        if self.trim_overlaps and held[0] < cue[0] < held[1]:
+            held[1] = cue[0]
+            self.stats.overlaps_trimmed += 1
+        return self._format(held, False)
+
+    def _format(self, cue, last):
+        (start_time, end_time, _, times, index, index_line, time_line, \
+            text) = cue
+        output = []
+        if self.renumber:
+            self.output_index += 1
+            if index != self.output_index:
+                self.stats.cues_renumbered += 1
+            output.append(str(self.output_index).encode('ascii') + \
+                self.newline)
+        elif index_line is not None:
+            output.append(index_line)
+        if (start_time, end_time) != times:
+            time_line = (ms_to_str(start_time) + ' --> ' + \
+                ms_to_str(end_time)).encode('ascii') + \
+                time_line[_TIME_LINE_WIDTH:]
+        output.append(time_line)
+        output.extend(text)
+        if not last:
+            # A cue moved away from the end of the file may lack its
+            # separating blank line
+            if not output[-1].endswith(b'\n'):
+                output[-1] += self.newline
+            if output[-1].strip():
+                output.append(self.newline)
+        return output
+
+
+
+class SyncPipeline(object):
+    """
+    A queue of synchronizations applied together in one pass over a file.
+
+    Every queueing method mirrors the module function of the same name
+    without the 'input_file' and 'output_file' arguments, and returns the
+    pipeline so calls can be chained:
+
+        SyncPipeline().sync_before_time('00:20:00,000', 800) \\
+            .sync_between_indexes(400, 650, 300, delay=False) \\
+            .sync_after_time('01:10:00,000', 1200) \\
+            .run('movie.srt')
+
+    The operations are applied to each cue in the order they were queued,
+    so the result is the same as calling the functions one after another.
+    A repair stage (see repair()) can follow them in the same pass.
+
+        operations           -- Initial operations (e.g. TimeShift objects)
+    """
+
+    def __init__(self, operations=()):
+        self.operations = list(operations)
+        self.repair_options = None
+
+    def __iter__(self):
+        return iter(self.operations)
+
+    def __len__(self):
+        return len(self.operations)
+
+    def __repr__(self):
+        if self.repair_options is None:
+            return '{}({!r})'.format(type(self).__name__, self.operations)
+        return '{}({!r}).repair({})'.format(type(self).__name__, \
+            self.operations, ', '.join('{}={!r}'.format(name, value) \
+            for name, value in sorted(self.repair_options.items())))
+
+    def add(self, operation):
+        """
+        Queues an operation, i.e. any object having an
+        apply(index, start_time, end_time) method.
+        """
+        self.operations.append(operation)
+        return self
+
+    def sync(self, sync_time_in_ms, delay=True):
+        """
+        Queues the synchronization of all the subtitles.
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay))
+
+    def sync_after_time(self, sync_after_time_str, sync_time_in_ms, \
+        delay=True):
+        """
+        Queues the synchronization of the subtitles occuring after a
+        specified time (hh:mm:ss,ms).
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, \
+            after_time_in_ms=time_str_to_ms(sync_after_time_str)))
+
+    def sync_before_time(self, sync_before_time_str, sync_time_in_ms, \
+        delay=True):
+        """
+        Queues the synchronization of the subtitles occuring before a
+        specified time (hh:mm:ss,ms).
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, \
+            before_time_in_ms=time_str_to_ms(sync_before_time_str)))
+
+    def sync_between_times(self, sync_after_time_str, sync_before_time_str, \
+        sync_time_in_ms, delay=True):
+        """
+        Queues the synchronization of the subtitles occuring between the
+        specified starting and ending times (hh:mm:ss,ms).
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, \
+            after_time_in_ms=time_str_to_ms(sync_after_time_str), \
+            before_time_in_ms=time_str_to_ms(sync_before_time_str)))
+
+    def sync_after_index(self, index, sync_time_in_ms, delay=True):
+        """
+        Queues the synchronization of the subtitles occuring after a
+        specified index.
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, after_index=index))
+
+    def sync_before_index(self, index, sync_time_in_ms, delay=True):
+        """
+        Queues the synchronization of the subtitles occuring before a
+        specified index.
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, before_index=index))
+
+    def sync_between_indexes(self, start_index, end_index, sync_time_in_ms, \
+        delay=True):
+        """
+        Queues the synchronization of the subtitles occuring between the
+        specified starting and ending indexes.
+        """
+        return self.add(TimeShift(sync_time_in_ms, delay, \
+            after_index=start_index, before_index=end_index))
+
+    def retime(self, scale=1, offset_in_ms=0):
+        """
+        Queues a linear retiming (time * scale + offset_in_ms) of all the
+        subtitles.
+        """
+        return self.add(LinearRetime(scale, offset_in_ms))
+
+    def convert_frame_rate(self, from_fps, to_fps):
+        """
+        Queues the retiming of all the subtitles for a video played at another
+        frame rate, e.g. convert_frame_rate(23.976, 25) for a PAL speed-up.
+        """
+        return self.add(LinearRetime(float(from_fps) / to_fps))
+
+    def sync_to_anchors(self, anchors):
+        """
+        Queues a piecewise-linear retiming of all the subtitles through
+        (source time -> target time) anchor points. See AnchorRetime.
+        """
+        return self.add(AnchorRetime(anchors))
+
+    def repair(self, renumber=True, window=64, trim_overlaps=True, \
+        drop_empty=True):
+        """
+        Adds a CueRepair stage after the operations, which reorders, trims,
+        drops and renumbers the synchronized cues in the same pass (see
+        CueRepair for the arguments). The stage applies to run(), sync_iter(),
+        sync_stream(), IncrementalSyncer and the services built on them; its
+        counters are added to the 'stats' of the run.
+        """
+        self.repair_options = dict(renumber=renumber, window=window, \
+            trim_overlaps=trim_overlaps, drop_empty=drop_empty)
+        return self
+
+    def repair_byte_lines(self, lines, stats=None):
+        """
+        Yields the lines of the repair stage applied to synchronized byte
+        lines, or the lines themselves if there is no repair stage.
+        """
+        if self.repair_options is None:
+            return iter(lines)
+        return CueRepair(stats=stats, **self.repair_options) \
+            .repair_byte_lines(lines)
+
+    def apply(self, index, start_time, end_time):
+        """
+        Returns the (start_time, end_time) of a cue after all the queued
+        operations.
+        """
+        for operation in self.operations:
+            (start_time, end_time) = \
+                operation.apply(index, start_time, end_time)
+        return (start_time, end_time)
+
+    def sync_lines(self, lines, tokenizer=None):
+        """
+        Yields the synchronized lines of a SRT file. Only timing lines changed
+        by the pipeline are rewritten; every other line is passed through.
+
+            lines            -- Iterable of lines (with line endings)
+            tokenizer        -- CueTokenizer carrying the state of the lines
+                                before 'lines', when a file is processed in
+                                slices.
+        """
+        operations = self.operations
+        if tokenizer is None:
+            tokenizer = CueTokenizer()
+        is_index = tokenizer.is_index
+        subtitle_index = tokenizer.subtitle_index
+        for each_line in lines:
+            if is_index(each_line):
+                subtitle_index = tokenizer.subtitle_index
+                yield each_line
+                continue
+
+            times = match_time_line(each_line)
+            if times is None:
+                yield each_line
+                continue
+
+            (start_time, end_time) = times
+            for operation in operations:
+                (start_time, end_time) = \
+                    operation.apply(subtitle_index, start_time, end_time)
+            if (start_time, end_time) == times:
+                yield each_line
+            else:
+                yield ms_to_str(start_time) + ' --> ' + ms_to_str(end_time) + \
+                    each_line[_TIME_LINE_WIDTH:]
+
+    def sync_byte_lines(self, lines, tokenizer=None, stats=None):
+        """
+        Same as sync_lines() for lines read in binary mode. Lines are never
+        decoded: timing lines are parsed and rewritten as ASCII bytes, and all
+        other bytes (text in any ASCII-compatible encoding, BOM, line endings)
+        are passed through unchanged.
+
+            lines            -- Iterable of byte lines, e.g. a binary file
+            tokenizer        -- CueTokenizer carrying the state of the lines
+                                before 'lines'
+            stats            -- SyncStats collecting the line and cue
+                                counters and the parse and transform times
+        """
+        if tokenizer is None:
+            tokenizer = CueTokenizer()
+        if stats is not None:
+            yield from self._sync_byte_lines_with_stats(lines, tokenizer, stats)
+            return
+        operations = self.operations
+        is_index = tokenizer.is_index_bytes
+        match = _TIME_LINE_BYTES_PATTERN.match
+        subtitle_index = tokenizer.subtitle_index
+        for each_line in lines:
+            if is_index(each_line):
+                subtitle_index = tokenizer.subtitle_index
+                yield each_line
+                continue
+
+            is_time_line = match(each_line)
+            if is_time_line is None:
+                yield each_line
+                continue
+
+            (sh, sm, ss, sms, eh, em, es, ems) = is_time_line.groups()
+            times = ((int(sh) * 3600 + int(sm) * 60 + int(ss)) * 1000 + \
+                int(sms), (int(eh) * 3600 + int(em) * 60 + int(es)) * 1000 + \
+                int(ems))
+            (start_time, end_time) = times
+            for operation in operations:
+                (start_time, end_time) = \
+                    operation.apply(subtitle_index, start_time, end_time)
+            if (start_time, end_time) == times:
+                yield each_line
+            else:
+                yield (ms_to_str(start_time) + ' --> ' + \
+                    ms_to_str(end_time)).encode('ascii') + \
+                    each_line[_TIME_LINE_WIDTH:]
+
+    def _sync_byte_lines_with_stats(self, lines, tokenizer, stats):
+        """
+        sync_byte_lines() timing every stage of every line.
+        """
+        operations = self.operations
+        is_index = tokenizer.is_index_bytes
+        match = _TIME_LINE_BYTES_PATTERN.match
+        clock = time.perf_counter
+        subtitle_index = tokenizer.subtitle_index
+        lines = iter(lines)
+        while True:
+            started = clock()
+            each_line = next(lines, None)
+            if each_line is None:
+                stats.parse_time += clock() - started
+                return
+            stats.lines_scanned += 1
+            stats.bytes_read += len(each_line)
+            if is_index(each_line):
+                subtitle_index = tokenizer.subtitle_index
+                is_time_line = None
+            else:
+                is_time_line = match(each_line)
+            if is_time_line is None:
+                stats.parse_time += clock() - started
+                yield each_line
+                continue
+
+            (sh, sm, ss, sms, eh, em, es, ems) = is_time_line.groups()
+            times = ((int(sh) * 3600 + int(sm) * 60 + int(ss)) * 1000 + \
+                int(sms), (int(eh) * 3600 + int(em) * 60 + int(es)) * 1000 + \
+                int(ems))
+            parsed = clock()
+            stats.parse_time += parsed - started
+            stats.time_lines_matched += 1
+            (start_time, end_time) = times
+            for operation in operations:
+                (start_time, end_time) = \
+                    operation.apply(subtitle_index, start_time, end_time)
+            if (start_time, end_time) != times:
+                stats.cues_modified += 1
+                each_line = (ms_to_str(start_time) + ' --> ' + \
+                    ms_to_str(end_time)).encode('ascii') + \
+                    each_line[_TIME_LINE_WIDTH:]
+            stats.transform_time += clock() - parsed
+            yield each_line
+
+    def run(self, input_file, output_file='', stats=None, fsync=False):
+        """
+        Applies all the queued operations to a subtitle file in one pass.
+        The file is processed as bytes (see sync_byte_lines()), so its
+        encoding, BOM and line endings are kept as they are, and written with
+        an AtomicFileWriter, so the output file is replaced in one step.
+        Unlike the sync_* functions, errors are raised instead of printed.
+
+            input_file       -- Path to the input SRT file.
+            output_file      -- With default value input file will be replaced.
+                                Change it to get output in different file.
+            stats            -- SyncStats collecting the counters and stage
+                                times of the run
+            fsync            -- True to flush the output to disk before
+                                returning
+        """
+        if not input_file.endswith(_SRT_EXTENSIONS):
+            raise ValueError('File needs to have .srt extension: ' + \
+                input_file)
+        if output_file == '':
+            output_file = input_file
+        with open_subtitle(input_file) as inputfile:
+            writer = AtomicFileWriter(output_file, fsync).open()
+            try:
+                writer.writelines(self.repair_byte_lines(\
+                    self.sync_byte_lines(inputfile, stats=stats), stats), stats)
+            except BaseException:
+                writer.abort()
+                raise
+        if stats is None:
+            writer.commit()
+        else:
+            committing = time.perf_counter()
+            writer.commit()
+            stats.commit_time += time.perf_counter() - committing
+            stats.committed()
+        return stats
+
+    def run_parallel(self, input_file, output_file='', max_workers=None, \
+        chunk_size=8 << 20):
+        """
+        Applies all the queued operations to a large subtitle file on a
+        process pool. The file is split at cue boundaries (a blank line
+        followed by an index line and a timing line) into chunks of about
+        'chunk_size' bytes, which are synchronized by the workers and written
+        back in order. At most two chunks per worker are in memory at once.
+
+        Each chunk starts with a fresh CueTokenizer, which gives the same
+        result as a single pass only if the previous chunk ended between two
+        cues. That is checked for every chunk, together with the continuity
+        of the indexes, and a chunk failing the check is synchronized again
+        in this process with the tokenizer state of the previous chunk.
+
+            input_file       -- Path to the input SRT file.
+            output_file      -- With default value input file will be replaced.
+                                Change it to get output in different file.
+            max_workers      -- Number of worker processes (defaults to the
+                                number of CPUs).
+            chunk_size       -- Approximate size (in bytes) of a chunk
+        """
+        if not input_file.endswith(_SRT_EXTENSIONS):
+            raise ValueError('File needs to have .srt extension: ' + \
+                input_file)
+        if output_file == '':
+            output_file = input_file
+        if self.repair_options is not None or _compression(input_file) or \
+            _compression(output_file):
+            # Cues move across chunk boundaries, compressed streams cannot be
+            # split
+            return self.run(input_file, output_file)
+        boundaries = _cue_boundaries(input_file, chunk_size)
+        if len(boundaries) <= 2:
+            return self.run(input_file, output_file)
+        if max_workers is None:
+            max_workers = os.cpu_count() or 1
+
+        jobs = [(self, input_file, start, end) \
+            for start, end in zip(boundaries, boundaries[1:])]
+        pending = deque()
+        tokenizer_state = [None]    # (expect_index, subtitle_index)
+
+        def write_next_chunk():
+            (job, future) = pending.popleft()
+            (data, first_index, expect_index, subtitle_index) = \
+                future.result()
+            previous = tokenizer_state[0]
+            if previous is not None and (not previous[0] or \
+                first_index != previous[1] + 1):
+                (data, first_index, expect_index, subtitle_index) = \
+                    _sync_chunk(job, previous)
+            writer.write(data)
+            tokenizer_state[0] = (expect_index, subtitle_index)
+
+        with ProcessPoolExecutor(max_workers) as executor, \
+            AtomicFileWriter(output_file) as writer:
+            for job in jobs:
+                pending.append((job, executor.submit(_sync_chunk, job)))
+                if len(pending) >= 2 * max_workers:
+                    write_next_chunk()
+            while pending:
+                write_next_chunk()
+
+    def run_in_place(self, input_file, stats=None):
+        """
+        Applies all the queued operations by overwriting the timestamps of a
+        subtitle file in place through a memory map. Nothing but the 29 bytes
+        of each changed timing line is written, and no temporary copy of the
+        file is made. Returns the number of cues changed.
+
+        Because the timestamps keep their width, every resulting time must
+        stay under 100 hours; otherwise ValueError is raised and the file is
+        left untouched. So it is for a pipeline with a repair stage.
+
+            input_file       -- Path to the SRT file to be modified.
+            stats            -- SyncStats collecting the cue and byte
+                                counters (lines are not split, so
+                                'lines_scanned' is not counted) and the
+                                transform and commit times
+        """
+        if not input_file.endswith(_SRT_EXTENSIONS):
+            raise ValueError('File needs to have .srt extension: ' + \
+                input_file)
+        if self.repair_options is not None:
+            raise ValueError('A repair stage cannot run in place; use run() ' \
+                'instead.')
+        if _compression(input_file) is not None:
+            raise ValueError('A compressed file cannot be synchronized in ' \
+                'place; use run() instead.')
+        started = time.perf_counter()
+        matched = 0
+        with open(input_file, 'r+b') as srtfile:
+            size = os.fstat(srtfile.fileno()).st_size
+            if size == 0:
+                if stats is not None:
+                    stats.committed()
+                return 0
+            with mmap.mmap(srtfile.fileno(), 0) as srtmap:
+                patches = []
+                subtitle_index = 0
+                for match in _INDEXED_TIME_LINE_BYTES_PATTERN.finditer(srtmap):
+                    matched += 1
+                    (index, sh, sm, ss, sms, eh, em, es, ems) = match.groups()
+                    if index is not None:
+                        subtitle_index = int(index)
+                    times = ((int(sh) * 3600 + int(sm) * 60 + int(ss)) * \
+                        1000 + int(sms), (int(eh) * 3600 + int(em) * 60 + \
+                        int(es)) * 1000 + int(ems))
+                    (start_time, end_time) = self.apply(subtitle_index, \
+                        times[0], times[1])
+                    if (start_time, end_time) == times:
+                        continue
+                    if not (0 <= start_time <= _MAX_FIXED_WIDTH_TIME_IN_MS and \
+                        0 <= end_time <= _MAX_FIXED_WIDTH_TIME_IN_MS):
+                        raise ValueError('Cue {} would leave the fixed-width' \
+                            ' timestamp range; use run() instead.'.format(\
+                                subtitle_index))
+                    patches.append((match.start(2), (ms_to_str(start_time) + \
+                        ' --> ' + ms_to_str(end_time)).encode('ascii')))
+                committing = time.perf_counter()
+                for (offset, timestamps) in patches:
+                    srtmap[offset:offset + _TIME_LINE_WIDTH] = timestamps
+                if patches:
+                    srtmap.flush()
+        if stats is not None:
+            stats.time_lines_matched += matched
+            stats.cues_modified += len(patches)
+            stats.bytes_read += size
+            stats.bytes_written += len(patches) * _TIME_LINE_WIDTH
+            stats.transform_time += committing - started
+            stats.commit_time += time.perf_counter() - committing
+            stats.committed()
+        return len(patches)
+
+
+
+def sync_to_anchors(anchors, input_file, output_file='', stats=None):
+    """
+    Retimes every subtitle by piecewise-linear interpolation through
+    (source time -> target time) anchor points, in a single pass. Unlike the
+    other sync_* functions, errors are raised instead of printed.
+
+        anchors              -- Iterable of (source_time, target_time) pairs,
+                                each time in millisecond or as a hh:mm:ss,ms
+                                string, e.g.
+                                [('00:10:00,000', '00:10:02,500'),
+                                 ('01:05:00,000', '01:04:58,000')]
+        input_file           -- Path to the input SRT file.
+        output_file          -- With default value input file will be replaced.
+                                Change it to get output in different file.
+        stats                -- SyncStats object collecting counters and stage
+                                times, which is also returned.
+    """
+    return SyncPipeline().sync_to_anchors(anchors).run(input_file, \
+        output_file, stats)
+
+
+
+def sync_in_place(input_file, sync_time_in_ms, delay=True, stats=None):
+    """
+    Synchronizes a complete subtitle file by overwriting its timestamps in
+    place, without rewriting the rest of the file. Returns the number of
+    cues changed. See SyncPipeline.run_in_place() for other ranges.
+
+    Unlike the other sync_* functions, errors are raised instead of printed:
+    ValueError if the file has no .srt extension, is compressed, or would
+    get a time of 100 hours or more (the file is then left untouched), and
+    OSError if it cannot be read or written.
+
+        input_file           -- Path to the SRT file to be modified.
+        sync_time_in_ms      -- Time (in millisecond) for which subtitle will
+                                be delayed, or hastened.
+        delay                -- True for delaying the subtitle, False for
+                                hastening it.
+        stats                -- SyncStats object collecting counters and stage
+                                times (see SyncPipeline.run_in_place())
+    """
+    return SyncPipeline().sync(sync_time_in_ms, delay).run_in_place(\
+        input_file, stats)
+
+
+
+class SubtitleCache(object):
+    """
+    A thread-safe, size-bounded LRU cache of parsed subtitles, for
+    long-running services that synchronize the same files many times with
+    different operations. Files are keyed by path, modification time and
+    size (no read at all on a hit), raw content by its SHA-256 hash. Entries
+    are evicted least recently used first once 'max_entries' or 'max_bytes'
+    is exceeded.
+
+    Documents are returned as copies, so they can be synchronized freely:
+
+        cache = SubtitleCache()
+        cache.sync('movie.srt', SyncPipeline().sync(1500), 'out.srt')
+
+        max_entries          -- Largest number of cached documents
+        max_bytes            -- Largest (approximate) memory used by the
+                                cached documents, None for no limit
+    """
+
+    def __init__(self, max_entries=128, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.size_in_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<{} entries={} bytes={} hits={} misses={} evictions={}>' \
+            .format(type(self).__name__, len(self), self.size_in_bytes, \
+                self.hits, self.misses, self.evictions)
+
+    @staticmethod
+    def _document_size(document):
+        return len(document.text) + 8 * (len(document.start_times) + \
+            len(document.end_times) + len(document.indexes) + \
+            len(document.text_offsets))
+
+    def _get(self, key):
+        with self._lock:
+            document = self._entries.get(key)
+            if document is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return document
+
+    def _put(self, key, document):
+        size = self._document_size(document)
+        with self._lock:
+            if key in self._entries:
+                self.size_in_bytes -= self._document_size(self._entries[key])
+            self._entries[key] = document
+            self._entries.move_to_end(key)
+            self.size_in_bytes += size
+            while self._entries and (len(self._entries) > self.max_entries or \
+                (self.max_bytes is not None and \
+                    self.size_in_bytes > self.max_bytes)):
+                (_, evicted) = self._entries.popitem(last=False)
+                self.size_in_bytes -= self._document_size(evicted)
+                self.evictions += 1
+
+    def get_document(self, input_file):
+        """
+        Returns a copy of the parsed document of a SRT file, parsing it only
+        if the file is not cached or has changed since it was cached.
+
+            input_file       -- Path to the SRT file
+        """
+        stat = os.stat(input_file)
+        key = ('file', os.path.abspath(input_file), stat.st_mtime_ns, \
+            stat.st_size)
+        document = self._get(key)
+        if document is None:
+            document = SubtitleDocument.from_file(input_file)
+            self._put(key, document)
+        return document.copy()
+
+    def get_document_from_bytes(self, srt_data):
+        """
+        Returns a copy of the parsed document of SRT content, parsing it only
+        if the same content is not cached.
+
+            srt_data         -- Content of a SRT file as bytes
+        """
+        key = ('sha256', hashlib.sha256(srt_data).digest())
+        document = self._get(key)
+        if document is None:
+            document = SubtitleDocument.from_bytes(srt_data)
+            self._put(key, document)
+        return document.copy()
+
+    def sync(self, input_file, pipeline, output_file=''):
+        """
+        Applies 'pipeline' to the cached document of a SRT file and saves it.
+        Returns the number of cues changed. The pipeline must not have a
+        repair stage (see SubtitleDocument.apply()).
+
+            input_file       -- Path to the input SRT file.
+            pipeline         -- SyncPipeline to be applied
+            output_file      -- With default value input file will be replaced.
+                                Change it to get output in different file.
+        """
+        document = self.get_document(input_file)
+        count = document.apply(pipeline)
+        document.save(output_file or input_file)
+        return count
+
+    def sync_bytes(self, srt_data, pipeline):
+        """
+        Applies 'pipeline' to the cached document of SRT content and returns
+        the synchronized content as bytes. The pipeline must not have a
+        repair stage.
+        """
+        document = self.get_document_from_bytes(srt_data)
+        document.apply(pipeline)
+        return document.to_bytes()
+
+    def clear(self):
+        """
+        Empties the cache (the counters are kept).
+        """
+        with self._lock:
+            self._entries.clear()
+            self.size_in_bytes = 0
+
+
+
+class CueIndex(object):
+    """
+    Byte offsets, indexes and times of the cues of a SRT file, kept in a
+    compact sidecar file (e.g. movie.srt.idx) for random access. The sidecar
+    records the size and modification time of the SRT file, and is ignored
+    once they change.
+
+    Use CueIndex.load_or_build() to get the index of a file, then
+    read_between_times() / read_between_indexes() to load only a slice of
+    the file, or sync_positions() to rewrite only a slice of it.
+
+        input_file           -- Path to the indexed SRT file
+    """
+    _MAGIC = b'SSIX'
+    _VERSION = 1
+    _HEADER = struct.Struct('<4sHBqqq')
+    _SORTED_BY_TIME = 1
+    _SORTED_BY_INDEX = 2
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+        self.file_size = 0
+        self.file_mtime_ns = 0
+        self.indexes = array('q')
+        self.start_times = array('q')
+        self.end_times = array('q')
+        self.byte_offsets = array('q')
+        self.sorted_by_time = True
+        self.sorted_by_index = True
+
+    def __len__(self):
+        return len(self.byte_offsets)
+
+    @staticmethod
+    def sidecar_path(input_file):
+        """
+        Returns the path of the sidecar index file of 'input_file'.
+        """
+        return input_file + '.idx'
+
+    @classmethod
+    def build(cls, input_file):
+        """
+        Scans a SRT file (as bytes, through a memory map) and returns its
+        index. A cue starts at its index line, or at its timing line if it
+        has none.
+        """
+        if _compression(input_file) is not None:
+            raise ValueError('A compressed file cannot be indexed: ' + \
+                input_file)
+        cue_index = cls(input_file)
+        with open(input_file, 'rb') as srtfile:
+            stat = os.fstat(srtfile.fileno())
+            cue_index.file_size = stat.st_size
+            cue_index.file_mtime_ns = stat.st_mtime_ns
+            if stat.st_size == 0:
+                return cue_index
+            with mmap.mmap(srtfile.fileno(), 0, access=mmap.ACCESS_READ) \
+                as srtmap:
+                subtitle_index = 0
+                for match in _INDEXED_TIME_LINE_BYTES_PATTERN.finditer(srtmap):
+                    (index, sh, sm, ss, sms, eh, em, es, ems) = match.groups()
+                    if index is not None:
+                        subtitle_index = int(index)
+                    cue_index.indexes.append(subtitle_index)
+                    cue_index.start_times.append((int(sh) * 3600 + \
+                        int(sm) * 60 + int(ss)) * 1000 + int(sms))
+                    cue_index.end_times.append((int(eh) * 3600 + \
+                        int(em) * 60 + int(es)) * 1000 + int(ems))
+                    cue_index.byte_offsets.append(match.start())
+        cue_index.sorted_by_time = all(previous <= current for previous, \
+            current in zip(cue_index.start_times, cue_index.start_times[1:]))
+        cue_index.sorted_by_index = all(previous <= current for previous, \
+            current in zip(cue_index.indexes, cue_index.indexes[1:]))
+        return cue_index
+
+    @classmethod
+    def load(cls, input_file):
+        """
+        Returns the index stored in the sidecar file of 'input_file', or None
+        if there is none or it is out of date.
+        """
+        try:
+            stat = os.stat(input_file)
+            with open(cls.sidecar_path(input_file), 'rb') as indexfile:
+                header = indexfile.read(cls._HEADER.size)
+                if len(header) != cls._HEADER.size:
+                    return None
+                (magic, version, flags, file_size, file_mtime_ns, count) = \
+                    cls._HEADER.unpack(header)
+                if magic != cls._MAGIC or version != cls._VERSION or \
+                    file_size != stat.st_size or \
+                    file_mtime_ns != stat.st_mtime_ns:
+                    return None
+                cue_index = cls(input_file)
+                cue_index.file_size = file_size
+                cue_index.file_mtime_ns = file_mtime_ns
+                cue_index.sorted_by_time = bool(flags & cls._SORTED_BY_TIME)
+                cue_index.sorted_by_index = bool(flags & cls._SORTED_BY_INDEX)
+                for column in (cue_index.indexes, cue_index.start_times, \
+                    cue_index.end_times, cue_index.byte_offsets):
+                    column.fromfile(indexfile, count)
+                    if sys.byteorder == 'big':
+                        column.byteswap()
+        except (OSError, EOFError):
+            return None
+        return cue_index
+
+    def save(self):
+        """
+        Writes the sidecar file of the indexed SRT file.
+        """
+        flags = (self._SORTED_BY_TIME if self.sorted_by_time else 0) | \
+            (self._SORTED_BY_INDEX if self.sorted_by_index else 0)
+        with AtomicFileWriter(self.sidecar_path(self.input_file)) as indexfile:
+            indexfile.write(self._HEADER.pack(self._MAGIC, self._VERSION, \
+                flags, self.file_size, self.file_mtime_ns, len(self)))
+            for column in (self.indexes, self.start_times, self.end_times, \
+                self.byte_offsets):
+                if sys.byteorder == 'big':
+                    column = array('q', column)
+                    column.byteswap()
+                indexfile.write(column.tobytes())
+
+    @classmethod
+    def load_or_build(cls, input_file, save=True):
+        """
+        Returns the index of 'input_file' from its sidecar file, or builds it
+        (and saves the sidecar if 'save' is True) when the sidecar is missing
+        or out of date.
+        """
+        cue_index = cls.load(input_file)
+        if cue_index is None:
+            cue_index = cls.build(input_file)
+            if save:
+                try:
+                    cue_index.save()
+                except OSError:
+                    pass        # A read-only directory only costs a rebuild
+        return cue_index
+
+    def positions_between_times(self, after_time_in_ms=None, \
+        before_time_in_ms=None):
+        """
+        Returns the positions of the cues starting after 'after_time_in_ms'
+        and ending before 'before_time_in_ms' (same comparisons as
+        sync_between_times()), found by binary search when the cues are in
+        time order.
+        """
+        if self.sorted_by_time:
+            first = 0 if after_time_in_ms is None else \
+                bisect.bisect_right(self.start_times, after_time_in_ms)
+            last = len(self) if before_time_in_ms is None else \
+                bisect.bisect_left(self.start_times, before_time_in_ms)
+            return [position for position in range(first, last) \
+                if before_time_in_ms is None or \
+                    self.end_times[position] < before_time_in_ms]
+        return [position for position, (start_time, end_time) in \
+            enumerate(zip(self.start_times, self.end_times)) \
+            if (after_time_in_ms is None or after_time_in_ms < start_time) and \
+                (before_time_in_ms is None or before_time_in_ms > end_time)]
+
+    def positions_between_indexes(self, start_index=None, end_index=None):
+        """
+        Returns the positions of the cues whose index is greater than
+        'start_index' and smaller than 'end_index' (same comparisons as
+        sync_between_indexes()), found by binary search when the indexes are
+        in order.
+        """
+        if self.sorted_by_index:
+            first = 0 if start_index is None else \
+                bisect.bisect_right(self.indexes, start_index)
+            last = len(self) if end_index is None else \
+                bisect.bisect_left(self.indexes, end_index)
+            return range(first, max(first, last))
+        return [position for position, index in enumerate(self.indexes) \
+            if (start_index is None or index > start_index) and \
+                (end_index is None or index < end_index)]
+
+    def byte_range(self, positions):
+        """
+        Returns the (start, end) byte offsets of the slice of the file
+        holding the cues at 'positions', or None if there are none.
+        """
+        if not len(positions):
+            return None
+        (first, last) = (min(positions), max(positions))
+        end = self.byte_offsets[last + 1] if last + 1 < len(self) else \
+            self.file_size
+        return (self.byte_offsets[first], end)
+
+    def _read_lines(self, byte_range):
+        with open(self.input_file, 'rb') as srtfile:
+            srtfile.seek(byte_range[0])
+            data = srtfile.read(byte_range[1] - byte_range[0])
+        return data.decode('utf-8', 'surrogateescape').splitlines(True)
+
+    def read_between_times(self, after_time_in_ms=None, \
+        before_time_in_ms=None):
+        """
+        Reads only the slice of the file holding the cues starting after
+        'after_time_in_ms' and ending before 'before_time_in_ms', and returns
+        it as a SubtitleDocument.
+        """
+        byte_range = self.byte_range(self.positions_between_times(\
+            after_time_in_ms, before_time_in_ms))
+        if byte_range is None:
+            return SubtitleDocument()
+        return SubtitleDocument(self._read_lines(byte_range))
+
+    def read_between_indexes(self, start_index=None, end_index=None):
+        """
+        Reads only the slice of the file holding the cues whose index is
+        greater than 'start_index' and smaller than 'end_index', and returns
+        it as a SubtitleDocument.
+        """
+        byte_range = self.byte_range(self.positions_between_indexes(\
+            start_index, end_index))
+        if byte_range is None:
+            return SubtitleDocument()
+        return SubtitleDocument(self._read_lines(byte_range))
+
+    def sync_positions(self, positions, pipeline, output_file='', stats=None):
+        """
+        Applies 'pipeline' to the slice of the file holding the cues at
+        'positions' only: the bytes before and after it are copied as they
+        are, without being parsed. The pipeline must not change cues outside
+        'positions', nor have a repair stage.
+
+            positions        -- Positions of the cues to be synchronized
+            pipeline         -- SyncPipeline to be applied
+            output_file      -- With default value input file will be
+                                replaced.
+            stats            -- SyncStats collecting the counters and stage
+                                times (of the slice only)
+        """
+        if pipeline.repair_options is not None:
+            raise ValueError('A repair stage needs the whole file; use ' \
+                'SyncPipeline.run() instead.')
+        if output_file == '':
+            output_file = self.input_file
+        byte_range = self.byte_range(positions)
+        if byte_range is None:
+            if output_file != self.input_file:
+                shutil.copyfile(self.input_file, output_file)
+            return stats
+        tokenizer = CueTokenizer()
+        tokenizer.subtitle_index = self.indexes[min(positions)]
+        with open(self.input_file, 'rb') as inputfile:
+            writer = AtomicFileWriter(output_file).open()
+            try:
+                _copy_bytes(inputfile, writer, byte_range[0])
+                writer.writelines(pipeline.sync_byte_lines(io.BytesIO(\
+                    inputfile.read(byte_range[1] - byte_range[0])), \
+                    tokenizer, stats), stats)
+                _copy_bytes(inputfile, writer, -1)
+            except BaseException:
+                writer.abort()
+                raise
+        committing = time.perf_counter()
+        writer.commit()
+        if stats is not None:
+            stats.commit_time += time.perf_counter() - committing
+            stats.committed()
+        return stats
+
+
+
+def _cue_boundaries(input_file, chunk_size):
+    """
+    Returns the byte offsets splitting a SRT file into chunks of about
+    'chunk_size' bytes, each starting with the index line of a cue (the
+    first offset is 0, the last one the size of the file).
+    """
+    boundaries = [0]
+    with open(input_file, 'rb') as srtfile:
+        file_size = os.fstat(srtfile.fileno()).st_size
+        if file_size <= chunk_size:
+            return [0, file_size]
+        with mmap.mmap(srtfile.fileno(), 0, access=mmap.ACCESS_READ) \
+            as srtmap:
+            position = chunk_size
+            while position < file_size:
+                match = _CUE_START_BYTES_PATTERN.search(srtmap, position)
+                if match is None:
+                    break
+                boundaries.append(match.start(1))
+                position = match.start(1) + chunk_size
+    boundaries.append(file_size)
+    return boundaries
+
+
+
+def _sync_chunk(job, tokenizer_state=None):
+    """
+    Synchronizes a byte range of a SRT file. Returns the synchronized bytes,
+    the index of the first cue (None if the chunk does not start with an
+    index line) and the final (expect_index, subtitle_index) tokenizer state.
+
+        job                  -- (pipeline, input_file, start, end) tuple
+        tokenizer_state      -- (expect_index, subtitle_index) to start from
+    """
+    (pipeline, input_file, start, end) = job
+    with open(input_file, 'rb') as inputfile:
+        inputfile.seek(start)
+        lines = io.BytesIO(inputfile.read(end - start)).readlines()
+    tokenizer = CueTokenizer()
+    if tokenizer_state is not None:
+        (tokenizer.expect_index, tokenizer.subtitle_index) = tokenizer_state
+    first_index = None
+    if lines and tokenizer.expect_index and \
+        CueTokenizer().is_index_bytes(lines[0]):
+        first_index = int(lines[0].strip())
+    data = b''.join(pipeline.sync_byte_lines(lines, tokenizer))
+    return (data, first_index, tokenizer.expect_index, tokenizer.subtitle_index)
+
+
+
+def _copy_bytes(inputfile, outputfile, size, buffer_size=1 << 20):
+    """
+    Copies 'size' bytes (all the remaining ones if 'size' is negative) from
+    one binary file object to another.
+    """
+    while size:
+        data = inputfile.read(buffer_size if size < 0 else \
+            min(size, buffer_size))
+        if not data:
+            break
+        outputfile.write(data)
+        if size > 0:
+            size -= len(data)
+
+
+
+class BatchResult(namedtuple('BatchResult', \
+    ['input_file', 'output_file', 'error_type', 'error_message'])):
+    """
+    Result of synchronizing one file in a batch. 'error_type' and
+    'error_message' are None when the file was synchronized.
+    """
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.error_type is None
+
+
+
+class BatchSummary(object):
+    """
+    Per-file results of sync_batch(), in the order the files were found.
+    """
+
+    def __init__(self, results):
+        self.results = list(results)
+        self.succeeded = [result for result in self.results if result.ok]
+        self.failed = [result for result in self.results if not result.ok]
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def __repr__(self):
+        return '<{} files={} succeeded={} failed={}>'.format(\
+            type(self).__name__, len(self.results), len(self.succeeded), \
+            len(self.failed))
+
+
+
+def find_srt_files(paths, recursive=True):
+    """
+    Returns the sorted list of SRT files found in 'paths', without duplicates.
+
+        paths                -- File paths, directories and glob patterns
+                                ('**' is supported). A single string is also
+                                accepted.
+        recursive            -- Look for SRT files in sub-directories of the
+                                given directories.
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    found = set()
+    for path in paths:
+        if os.path.isdir(path):
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(path):
+                    found.update(os.path.normpath(os.path.join(dirpath, \
+                        filename)) \
+                        for filename in filenames \
+                        if filename.endswith(_SRT_EXTENSIONS))
+            else:
+                found.update(os.path.normpath(os.path.join(path, filename)) \
+                    for filename in os.listdir(path) \
+                    if filename.endswith(_SRT_EXTENSIONS) and \
+                        os.path.isfile(os.path.join(path, filename)))
+        elif os.path.isfile(path):
+            found.add(os.path.normpath(path))
+        else:
+            found.update(os.path.normpath(filename) for filename in \
+                glob.glob(path, recursive=True) if os.path.isfile(filename))
+    return sorted(found)
+
+
+
+def _output_base_dir(paths):
+    """
+    Returns the directory the output paths of a batch are relative to: the
+    current directory if all the files found in 'paths' are under it, the
+    deepest directory containing all of them otherwise, so that two input
+    files never share an output file.
+
+        paths                -- File paths, directories and glob patterns
+    """
+    if isinstance(paths, str):
+        paths = [paths]
+    roots = []
+    for path in paths:
+        if not os.path.isdir(path):
+            # The directory of a file, or the part of a glob pattern before
+            # its first wildcard
+            path = os.path.dirname(path)
+            while glob.has_magic(path):
+                path = os.path.dirname(path)
+        roots.append(os.path.abspath(path))
+    current_dir = os.getcwd()
+    if all(os.path.commonpath([root, current_dir]) == current_dir \
+        for root in roots):
+        return current_dir
+    return os.path.commonpath(roots)
+
+
+
+def _batch_output_file(input_file, output_dir, base_dir):
+    """
+    Returns the output file of 'input_file' in 'output_dir' (keeping its path
+    relative to 'base_dir'), creating its directory, or 'input_file' itself
+    if 'output_dir' is None.
+    """
+    if output_dir is None:
+        return input_file
+    output_file = os.path.join(output_dir, \
+        os.path.relpath(os.path.abspath(input_file), base_dir))
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    return output_file
+
+
+
+def _sync_batch_file(job):
+    """
+        job                  -- (pipeline, input_file, output_file) tuple
+    """
+    (pipeline, input_file, output_file) = job
+    try:
+        pipeline.run(input_file, output_file)
+    except Exception as err:
+        return BatchResult(input_file, output_file, type(err).__name__, \
+            str(err))
+    return BatchResult(input_file, output_file, None, None)
+
+
+
+def sync_batch(paths, pipeline, output_dir=None, max_workers=None, \
+    recursive=True):
+    """
+    Synchronizes every SRT file found in 'paths' on a process pool and
+    returns a BatchSummary. Errors are collected per file instead of being
+    printed, so one bad file does not stop the batch.
+
+        paths                -- File paths, directories and glob patterns
+        pipeline             -- SyncPipeline applied to every file
+        output_dir           -- With default value the files are replaced.
+                                Otherwise the output files are written in
+                                this directory, keeping their path relative
+                                to the current directory (or, if some files
+                                are outside it, to the deepest directory
+                                containing all of them).
+        max_workers          -- Number of worker processes (defaults to the
+                                number of CPUs).
+        recursive            -- Look for SRT files in sub-directories.
+    """
+    base_dir = _output_base_dir(paths)
+    jobs = [(pipeline, input_file, _batch_output_file(input_file, \
+        output_dir, base_dir)) for input_file in find_srt_files(paths, \
+        recursive)]
+    if not jobs:
+        return BatchSummary([])
+
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(jobs))
+    chunksize = max(1, len(jobs) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers) as executor:
+        return BatchSummary(executor.map(_sync_batch_file, jobs, \
+            chunksize=chunksize))
+
+
+
+def sync_iter(input_lines, pipeline):
+    """
+    Yields the synchronized lines of a subtitle stream, one line at a time,
+    so memory use does not depend on the size of the input.
+
+    Text lines give text lines. Byte lines, e.g. from a binary file object,
+    give byte lines; they are never decoded, so any ASCII-compatible encoding
+    is passed through unchanged, and line endings are never translated.
+
+        input_lines          -- Iterable of lines (with line endings), or a
+                                file object
+        pipeline             -- SyncPipeline to be applied
+    """
+    input_lines = iter(input_lines)
+    for first_line in input_lines:
+        input_lines = itertools.chain([first_line], input_lines)
+        if pipeline.repair_options is None:
+            if isinstance(first_line, str):
+                yield from pipeline.sync_lines(input_lines)
+            else:
+                yield from pipeline.sync_byte_lines(input_lines)
+        elif isinstance(first_line, str):
+            # The repair stage works on bytes
+            for each_line in pipeline.repair_byte_lines(\
+                pipeline.sync_byte_lines(each_line.encode('utf-8', \
+                'surrogateescape') for each_line in input_lines)):
+                yield each_line.decode('utf-8', 'surrogateescape')
+        else:
+            yield from pipeline.repair_byte_lines(\
+                pipeline.sync_byte_lines(input_lines))
+
+
+
+def sync_stream(inputfile, outputfile, pipeline):
+    """
+    Synchronizes a subtitle stream from one file object into another without
+    any temporary file. Either file object can be text or binary.
+
+        inputfile            -- File object (or iterable of lines) to read
+        outputfile           -- File object to write
+        pipeline             -- SyncPipeline to be applied
+    """
+    text_output = isinstance(outputfile, io.TextIOBase)
+    for each_line in sync_iter(inputfile, pipeline):
+        if isinstance(each_line, str) != text_output:
+            if text_output:
+                each_line = each_line.decode('utf-8', 'surrogateescape')
+            else:
+                each_line = each_line.encode('utf-8', 'surrogateescape')
+        outputfile.write(each_line)
+
+
+
+_FRAME_RATE_SCALES = (23.976 / 24, 24 / 23.976, 24 / 25, 25 / 24, \
+    23.976 / 25, 25 / 23.976, 25 / 29.97, 29.97 / 25, 23.976 / 29.97, \
+    29.97 / 23.976)
+
+
+
+class SyncEstimate(namedtuple('SyncEstimate', \
+    ['offset_in_ms', 'scale', 'score'])):
+    """
+    Result of estimate_sync(): the target times must be retimed to
+    time * scale + offset_in_ms to match the reference. 'score' is the
+    normalized correlation of the two speech activity signals (1 is a
+    perfect match).
+    """
+    __slots__ = ()
+
+    @property
+    def sync_time_in_ms(self):
+        """
+        The 'sync_time_in_ms' argument of the sync_* functions.
+        """
+        return abs(self.offset_in_ms)
+
+    @property
+    def delay(self):
+        """
+        The 'delay' argument of the sync_* functions.
+        """
+        return self.offset_in_ms >= 0
+
+    def to_pipeline(self):
+        """
+        Returns a SyncPipeline applying this estimate.
+        """
+        if self.scale == 1:
+            return SyncPipeline().sync(self.sync_time_in_ms, self.delay)
+        return SyncPipeline().retime(self.scale, self.offset_in_ms)
+
+
+
+def _fft(values, inverse=False):
+    """
+    Iterative radix-2 FFT, used when NumPy is not installed. The length of
+    'values' must be a power of 2.
+    """
+    values = list(values)
+    size = len(values)
+    j = 0
+    for i in range(1, size):
+        bit = size >> 1
+        while j & bit:
+            j ^= bit
+            bit >>= 1
+        j |= bit
+        if i < j:
+            (values[i], values[j]) = (values[j], values[i])
+    sign = 2j if inverse else -2j
+    length = 2
+    while length <= size:
+        half = length >> 1
+        twiddles = [cmath.exp(sign * math.pi * k / length) \
+            for k in range(half)]
+        for first in range(0, size, length):
+            for k in range(half):
+                u = values[first + k]
+                v = values[first + k + half] * twiddles[k]
+                values[first + k] = u + v
+                values[first + k + half] = u - v
+        length <<= 1
+    if inverse:
+        values = [value / size for value in values]
+    return values
+
+
+
+def _activity_signal(start_times, end_times, resolution_in_ms, scale=1):
+    """
+    Returns the binary speech activity signal of the cues: one sample per
+    'resolution_in_ms', 1 while a cue is shown.
+    """
+    length = int(max(end_times) * scale // resolution_in_ms) + 2
+    if numpy is not None:
+        starts = (numpy.frombuffer(start_times, dtype=numpy.int64) * \
+            scale // resolution_in_ms).astype(numpy.int64)
+        ends = (numpy.frombuffer(end_times, dtype=numpy.int64) * \
+            scale // resolution_in_ms).astype(numpy.int64)
+        steps = numpy.zeros(length + 1, dtype=numpy.int64)
+        numpy.add.at(steps, starts, 1)
+        numpy.add.at(steps, numpy.maximum(ends, starts), -1)
+        return (numpy.cumsum(steps[:length]) > 0).astype(numpy.float64)
+    signal = bytearray(length)
+    for start_time, end_time in zip(start_times, end_times):
+        first = int(start_time * scale // resolution_in_ms)
+        last = int(end_time * scale // resolution_in_ms)
+        signal[first:last] = b'\x01' * max(0, last - first)
+    return signal
+
+
+
+def _best_lag(reference, target, max_lag):
+    """
+    Returns the (lag, correlation) maximizing the cross-correlation of two
+    signals, computed with FFTs in O(n log n). A positive lag means the
+    target must be delayed. 'max_lag' (in samples) can be None.
+    """
+    size = 1
+    while size < len(reference) + len(target):
+        size <<= 1
+    if numpy is not None:
+        correlation = numpy.fft.irfft(numpy.fft.rfft(reference, size) * \
+            numpy.conj(numpy.fft.rfft(target, size)), size)
+    else:
+        reference_spectrum = _fft(list(reference) + \
+            [0] * (size - len(reference)))
+        target_spectrum = _fft(list(target) + [0] * (size - len(target)))
+        correlation = [value.real for value in _fft([a * b.conjugate() \
+            for a, b in zip(reference_spectrum, target_spectrum)], True)]
+    if max_lag is None:
+        max_lag = size
+    best = (0, correlation[0])
+    for lag in range(-min(max_lag, len(target) - 1), \
+        min(max_lag, len(reference) - 1) + 1):
+        value = correlation[lag]    # negative lags wrap around to the end
+        if value > best[1] + 1e-9:
+            best = (lag, value)
+    return (best[0], float(best[1]))
+
+
+
+def estimate_sync(reference_file, target_file, estimate_drift=False, \
+    resolution_in_ms=None, max_offset_in_ms=None, scales=None):
+    """
+    Estimates how to synchronize 'target_file' with 'reference_file', by
+    turning the cue timings of both into binary speech activity signals and
+    finding the offset with the best cross-correlation. Returns a
+    SyncEstimate, which can be fed into the sync functions:
+
+        estimate = estimate_sync('reference.srt', 'movie.srt')
+        sync('movie.srt', estimate.sync_time_in_ms, estimate.delay)
+
+        reference_file       -- Path to a correctly timed SRT file, or a
+                                SubtitleDocument
+        target_file          -- Path to the SRT file to be synchronized, or a
+                                SubtitleDocument
+        estimate_drift       -- Also try the usual frame-rate conversion
+                                factors (or 'scales') as a linear drift.
+        resolution_in_ms     -- Length of a signal sample. Defaults to 10 ms
+                                with NumPy and 100 ms without it.
+        max_offset_in_ms     -- Largest offset looked for (defaults to the
+                                length of the subtitles).
+        scales               -- Drift factors tried when 'estimate_drift' is
+                                True.
+    """
+    if not isinstance(reference_file, SubtitleDocument):
+        reference_file = SubtitleDocument.from_file(reference_file)
+    if not isinstance(target_file, SubtitleDocument):
+        target_file = SubtitleDocument.from_file(target_file)
+    if not len(reference_file) or not len(target_file):
+        raise ValueError('Both subtitles need at least one cue.')
+    if resolution_in_ms is None:
+        resolution_in_ms = 100 if numpy is None else 10
+    max_lag = None
+    if max_offset_in_ms is not None:
+        max_lag = max_offset_in_ms // resolution_in_ms
+
+    candidate_scales = [1]
+    if estimate_drift:
+        candidate_scales.extend(_FRAME_RATE_SCALES if scales is None \
+            else scales)
+
+    reference = _activity_signal(reference_file.start_times, \
+        reference_file.end_times, resolution_in_ms)
+    reference_energy = float(sum(reference))
+    best = None
+    for scale in candidate_scales:
+        target = _activity_signal(target_file.start_times, \
+            target_file.end_times, resolution_in_ms, scale)
+        (lag, value) = _best_lag(reference, target, max_lag)
+        score = value / math.sqrt(reference_energy * float(sum(target)) or 1)
+        if best is None or score > best.score + 1e-9:
+            best = SyncEstimate(lag * resolution_in_ms, scale, score)
+    return best
+
+
+
+class IncrementalSyncer(object):
+    """
+    Synchronizes a subtitle arriving in arbitrary byte chunks (request
+    bodies, sockets, object-store streams): feed() returns the synchronized
+    bytes of every complete line received so far, close() the rest. Memory
+    is bounded by the chunk size, and the tokenizer state is carried from
+    chunk to chunk.
+
+        pipeline             -- SyncPipeline to be applied
+        stats                -- SyncStats collecting the counters
+    """
+
+    def __init__(self, pipeline, stats=None):
+        self.pipeline = pipeline
+        self.stats = stats
+        self.tokenizer = CueTokenizer()
+        self.remainder = b''
+        if pipeline.repair_options is None:
+            self.repair = None
+        else:
+            self.repair = CueRepair(stats=stats, **pipeline.repair_options)
+
+    def _sync(self, lines):
+        lines = self.pipeline.sync_byte_lines(lines, self.tokenizer, \
+            self.stats)
+        if self.repair is not None:
+            lines = itertools.chain.from_iterable(map(self.repair.feed, lines))
+        return self._output(b''.join(lines))
+
+    def _output(self, data):
+        if self.stats is not None:
+            self.stats.bytes_written += len(data)
+        return data
+
+    def feed(self, data):
+        """
+        Returns the synchronized bytes of the complete lines in 'data' (and
+        in the incomplete line kept from the previous chunk).
+        """
+        data = self.remainder + data
+        end = data.rfind(b'\n') + 1
+        self.remainder = data[end:]
+        if not end:
+            return b''
+        return self._sync(io.BytesIO(data[:end]))
+
+    def close(self):
+        """
+        Returns the synchronized bytes of the last line, if it has no line
+        ending, and of the cues held by the repair stage, if any.
+        """
+        (data, self.remainder) = (self.remainder, b'')
+        output = self._sync([data] if data else [])
+        if self.repair is not None:
+            output += self._output(b''.join(self.repair.close()))
+        return output
+
+
+
+class AsyncSubtitleSyncer(object):
+    """
+    asyncio counterparts of the sync functions, for event-loop servers.
+    Files are read, synchronized and written batch by batch in an executor,
+    so the event loop is never blocked for more than a scheduling step, and
+    at most 'max_concurrency' synchronizations run at once (the others wait
+    their turn). Cancelling a synchronization discards its partial output
+    and leaves the output file untouched. Errors are raised, not printed.
+
+        async with AsyncSubtitleSyncer(max_concurrency=16) as syncer:
+            await syncer.sync('movie.srt', 1500)
+
+    The thread pool created by default is shut down by close() or aclose(),
+    or at the end of the 'async with' block; an executor given by the caller
+    is left running.
+
+        max_concurrency      -- Largest number of concurrent synchronizations
+        executor             -- concurrent.futures executor running the
+                                blocking work (a thread pool by default)
+        batch_size           -- Size (in bytes) of the batches read and
+                                synchronized in one executor call
+    """
+
+    def __init__(self, max_concurrency=8, executor=None, batch_size=1 << 18):
+        self.max_concurrency = max_concurrency
+        self.executor = executor
+        self.batch_size = batch_size
+        self._semaphore = None
+        self._own_executor = False
+
+    def _get_semaphore(self):
+        # Created on first use, inside the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(self.max_concurrency)
+            self._own_executor = True
+        return self.executor
+
+    def close(self):
+        """
+        Shuts down the thread pool created by default, once the calls
+        running in it are over.
+        """
+        if self._own_executor:
+            self.executor.shutdown()
+            self.executor = None
+            self._own_executor = False
+
+    async def aclose(self):
+        """
+        Same as close(), without blocking the event loop.
+        """
+        if self._own_executor:
+            (executor, self.executor) = (self.executor, None)
+            self._own_executor = False
+            await asyncio.get_running_loop().run_in_executor(None, \
+                executor.shutdown)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.aclose()
+        return False
+
+    async def _call(self, function, *args, last_call=None):
+        """
+        Runs 'function' in the executor. The concurrent.futures.Future is
+        stored in 'last_call' (a list) if given, so that a cancelled caller
+        can wait for the call, which cannot be interrupted, to finish.
+        """
+        future = self._get_executor().submit(function, *args)
+        if last_call is not None:
+            last_call[:] = [future]
+        return await asyncio.wrap_future(future)
+
+    async def run(self, pipeline, input_file, output_file='', stats=None):
+        """
+        Applies a SyncPipeline to a subtitle file without blocking the event
+        loop. Same as SyncPipeline.run().
+        """
+        if not input_file.endswith(_SRT_EXTENSIONS):
+            raise ValueError('File needs to have .srt extension: ' + \
+                input_file)
+        if output_file == '':
+            output_file = input_file
+        async with self._get_semaphore():
+            inputfiles = []
+            writer = AtomicFileWriter(output_file)
+            syncer = IncrementalSyncer(pipeline, stats)
+            batch_size = self.batch_size
+
+            def open_input():
+                inputfiles.append(open_subtitle(input_file))
+                writer.open()
+
+            def sync_next_batch():
+                data = inputfiles[0].read(batch_size)
+                writer.write(syncer.feed(data) if data else syncer.close())
+                return bool(data)
+
+            def cleanup(future=None):
+                writer.abort()
+                for inputfile in inputfiles:
+                    inputfile.close()
+
+            last_call = []
+            try:
+                await self._call(open_input, last_call=last_call)
+                while await self._call(sync_next_batch, last_call=last_call):
+                    pass
+                await self._call(writer.commit, last_call=last_call)
+            except BaseException:
+                # Clean up once the batch running in the executor is over
+                if last_call and not last_call[0].done():
+                    last_call[0].add_done_callback(cleanup)
+                else:
+                    cleanup()
+                raise
+            inputfiles[0].close()
+        if stats is not None:
+            stats.committed()
+        return stats
+
+    async def sync_stream(self, reader, writer, pipeline, stats=None):
+        """
+        Synchronizes a subtitle from an asyncio.StreamReader (or any object
+        with an async read(n) method) into an asyncio.StreamWriter (or any
+        object with write() and an async drain() method).
+        """
+        syncer = IncrementalSyncer(pipeline, stats)
+        async with self._get_semaphore():
+            while True:
+                data = await reader.read(self.batch_size)
+                if not data:
+                    break
+                writer.write(await self._call(syncer.feed, data))
+                await writer.drain()
+            writer.write(syncer.close())
+            await writer.drain()
+        return stats
+
+    async def sync(self, input_file, sync_time_in_ms, delay=True, \
+        output_file='', stats=None):
+        """
+        Synchronizes a complete subtitle file. See sync().
+        """
+        return await self.run(SyncPipeline().sync(sync_time_in_ms, delay), \
+            input_file, output_file, stats)
+
+    async def sync_after_time(self, sync_after_time_str, input_file, \
+        sync_time_in_ms, delay=True, output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring after a specified time. See
+        sync_after_time().
+        """
+        return await self.run(SyncPipeline().sync_after_time(\
+            sync_after_time_str, sync_time_in_ms, delay), input_file, \
+            output_file, stats)
+
+    async def sync_before_time(self, sync_before_time_str, input_file, \
+        sync_time_in_ms, delay=True, output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring before a specified time. See
+        sync_before_time().
+        """
+        return await self.run(SyncPipeline().sync_before_time(\
+            sync_before_time_str, sync_time_in_ms, delay), input_file, \
+            output_file, stats)
+
+    async def sync_between_times(self, sync_after_time_str, \
+        sync_before_time_str, input_file, sync_time_in_ms, delay=True, \
+        output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring between the specified starting and
+        ending times. See sync_between_times().
+        """
+        return await self.run(SyncPipeline().sync_between_times(\
+            sync_after_time_str, sync_before_time_str, sync_time_in_ms, \
+            delay), input_file, output_file, stats)
+
+    async def sync_after_index(self, index, input_file, sync_time_in_ms, \
+        delay=True, output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring after a specified index. See
+        sync_after_index().
+        """
+        return await self.run(SyncPipeline().sync_after_index(index, \
+            sync_time_in_ms, delay), input_file, output_file, stats)
+
+    async def sync_before_index(self, index, input_file, sync_time_in_ms, \
+        delay=True, output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring before a specified index. See
+        sync_before_index().
+        """
+        return await self.run(SyncPipeline().sync_before_index(index, \
+            sync_time_in_ms, delay), input_file, output_file, stats)
+
+    async def sync_between_indexes(self, start_index, end_index, input_file, \
+        sync_time_in_ms, delay=True, output_file='', stats=None):
+        """
+        Synchronizes the subtitles occuring between the specified starting and
+        ending indexes. See sync_between_indexes().
+        """
+        return await self.run(SyncPipeline().sync_between_indexes(\
+            start_index, end_index, sync_time_in_ms, delay), input_file, \
+            output_file, stats)
+
+
+
+def _query_flag(value):
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError('Invalid boolean value: ' + value)
+
+
+
+def pipeline_from_query(query):
+    """
+    Returns the SyncPipeline described by the parameters of a URL query
+    string, named after the arguments of the sync functions (and 'repair' to
+    add a repair stage with the default options):
+
+        sync_time_in_ms=1500&delay=false&after_time=00:10:00,000
+
+        query                -- Query string, or dict of lists of values as
+                                returned by urllib.parse.parse_qs()
+
+    Raises ValueError if a parameter is missing, unknown or invalid.
+    """
+    if isinstance(query, str):
+        query = urllib.parse.parse_qs(query, keep_blank_values=True, \
+            strict_parsing=bool(query))
+    parsers = {'sync_time_in_ms': int, 'delay': _query_flag, \
+        'after_time': time_str_to_ms, 'before_time': time_str_to_ms, \
+        'after_index': int, 'before_index': int, 'repair': _query_flag}
+    params = {}
+    for name, values in query.items():
+        if name not in parsers:
+            raise ValueError('Unknown parameter: ' + name)
+        if len(values) != 1:
+            raise ValueError('Parameter given more than once: ' + name)
+        try:
+            params[name] = parsers[name](values[0])
+        except ValueError:
+            raise ValueError('Invalid value of {}: {!r}'.format(name, \
+                values[0]))
+    if 'sync_time_in_ms' not in params:
+        raise ValueError('Missing parameter: sync_time_in_ms')
+    pipeline = SyncPipeline().add(TimeShift(params['sync_time_in_ms'], \
+        params.get('delay', True), \
+        after_time_in_ms=params.get('after_time'), \
+        before_time_in_ms=params.get('before_time'), \
+        after_index=params.get('after_index'), \
+        before_index=params.get('before_index')))
+    if params.get('repair'):
+        pipeline.repair()
+    return pipeline
+
+
+
+class _SyncRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Request handler of SyncServer.
+    """
+    protocol_version = 'HTTP/1.1'
+    server_version = 'sync_subtitle'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            http.server.BaseHTTPRequestHandler.log_message(self, format, \
+                *args)
+
+    def send_json(self, code, body):
+        data = json.dumps(body, sort_keys=True).encode('utf-8') + b'\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, code, message):
+        self.server.record(rejected=True)
+        self.send_json(code, {'error': message})
+
+    def write_chunk(self, data):
+        if data:
+            self.wfile.write('{:x}\r\n'.format(len(data)).encode('ascii') + \
+                data + b'\r\n')
+
+    def do_GET(self):
+        path = urllib.parse.urlsplit(self.path).path
+        if path == '/health':
+            self.send_json(200, {'status': 'ok', 'pid': os.getpid()})
+        elif path == '/metrics':
+            self.send_json(200, self.server.metrics())
+        else:
+            self.send_error_json(404, 'Not found: ' + path)
+
+    def do_POST(self):
+        # The body is only read once the request is accepted, so the
+        # connection cannot be reused after an error
+        self.close_connection = True
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != '/sync':
+            self.send_error_json(404, 'Not found: ' + url.path)
+            return
+        try:
+            pipeline = pipeline_from_query(url.query)
+        except ValueError as valerr:
+            self.send_error_json(400, str(valerr))
+            return
+        if 'Transfer-Encoding' in self.headers or \
+            'Content-Length' not in self.headers:
+            self.send_error_json(411, 'Content-Length required')
+            return
+        try:
+            length = int(self.headers['Content-Length'])
+            if length < 0:
+                raise ValueError
+        except ValueError:
+            self.send_error_json(400, 'Invalid Content-Length')
+            return
+        if length > self.server.max_request_size:
+            self.send_error_json(413, 'Request body larger than {} bytes' \
+                .format(self.server.max_request_size))
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-subrip')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        stats = SyncStats()
+        syncer = IncrementalSyncer(pipeline, stats)
+        try:
+            while length:
+                data = self.rfile.read(min(length, self.server.chunk_size))
+                if not data:
+                    raise ConnectionError('Request body truncated')
+                length -= len(data)
+                self.write_chunk(syncer.feed(data))
+            self.write_chunk(syncer.close())
+            self.wfile.write(b'0\r\n\r\n')
+            self.close_connection = False
+        except (ConnectionError, OSError):
+            # The status line is gone: the client sees a truncated response
+            self.server.record(stats, error=True)
+            return
+        self.server.record(stats)
+
+
+
+class SyncServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    """
+    A stdlib-only HTTP service synchronizing subtitles, so that scripts can
+    share a warm process instead of importing the module per request.
+
+        POST /sync?sync_time_in_ms=1500&delay=false&after_index=10
+                             -- Returns the synchronized SRT body, streamed
+                                with chunked transfer encoding while the
+                                request body is read (see pipeline_from_query
+                                for the parameters)
+        GET /health          -- {"status": "ok", "pid": ...}
+        GET /metrics         -- Request counters and SyncStats counters,
+                                summed over all the workers
+
+    Bodies without a Content-Length are refused (411), larger ones than
+    'max_request_size' too (413).
+
+        server_address       -- (host, port) to listen on
+        max_request_size     -- Largest accepted request body, in bytes
+        chunk_size           -- Size of the blocks of the body read and
+                                synchronized at once
+        verbose              -- Log the requests on standard error
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+    _COUNTERS = ('requests', 'errors', 'rejected') + SyncStats._COUNTERS
+
+    def __init__(self, server_address=('127.0.0.1', 8000), \
+        max_request_size=64 << 20, chunk_size=1 << 16, verbose=False):
+        http.server.HTTPServer.__init__(self, server_address, \
+            _SyncRequestHandler)
+        self.max_request_size = max_request_size
+        self.chunk_size = chunk_size
+        self.verbose = verbose
+        self.workers = 1
+        self.started = time.time()
+        # Allocated before forking, so that all the workers add to it
+        self._counters = multiprocessing.Array('d', len(self._COUNTERS))
+
+    def record(self, stats=None, error=False, rejected=False):
+        """
+        Adds a request (and its SyncStats) to the counters.
+        """
+        with self._counters.get_lock():
+            self._counters[0] += 1
+            self._counters[1] += error
+            self._counters[2] += rejected
+            if stats is not None:
+                for position, name in enumerate(SyncStats._COUNTERS, 3):
+                    self._counters[position] += getattr(stats, name)
+
+    def metrics(self):
+        """
+        Returns the counters of all the workers as a dict.
+        """
+        with self._counters.get_lock():
+            values = self._counters[:]
+        metrics = dict((name, value if name.endswith('_time') else \
+            int(value)) for name, value in zip(self._COUNTERS, values))
+        metrics.update(pid=os.getpid(), workers=self.workers, \
+            uptime=time.time() - self.started)
+        return metrics
+
+    def _fork_worker(self):
+        pid = os.fork()
+        if pid:
+            return pid
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            self.serve_forever()
+        except BaseException:
+            status = 1
+        finally:
+            os._exit(status)
+
+    def serve_forked(self, workers=None):
+        """
+        Serves requests in a pool of worker processes forked after binding
+        the socket, which all accept connections on it; a worker that dies
+        is replaced. Returns when the parent process receives SIGINT or
+        SIGTERM, after stopping the workers. Falls back to serving in this
+        process (one thread per connection) where os.fork() is unavailable.
+
+            workers          -- Number of worker processes, the number of
+                                CPUs by default
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.workers = workers
+        if workers <= 1 or not hasattr(os, 'fork'):
+            try:
+                self.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                self.server_close()
+            return
+
+        if threading.current_thread() is threading.main_thread():
+            previous_handler = signal.signal(signal.SIGTERM, \
+                lambda signum, frame: sys.exit(0))
+        else:
+            previous_handler = None
+        children = set()
+        try:
+            for _ in range(workers):
+                children.add(self._fork_worker())
+            while True:
+                (pid, _) = os.wait()
+                children.discard(pid)
+                children.add(self._fork_worker())
+        except (KeyboardInterrupt, SystemExit):
+            pass
+        finally:
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            for pid in children:
+                try:
+                    os.waitpid(pid, 0)
+                except OSError:
+                    pass
+            self.server_close()
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+
+
+
+def serve(host='127.0.0.1', port=8000, workers=None, \
+    max_request_size=64 << 20):
+    """
+    Runs a SyncServer until interrupted (see SyncServer for the endpoints).
+
+        host                 -- Address to listen on
+        port                 -- Port to listen on
+        workers              -- Number of worker processes, the number of
+                                CPUs by default
+        max_request_size     -- Largest accepted request body, in bytes
+    """
+    server = SyncServer((host, port), max_request_size)
+    print('Serving on http://{}:{}/ with {} workers'.format(\
+        *server.server_address[:2], workers or os.cpu_count() or 1), \
+        file=sys.stderr)
+    server.serve_forked(workers)
+
+
+
+class Cue(namedtuple('Cue', \
+    ['index', 'start_time', 'end_time', 'settings', 'lines'])):
+    """
+    A cue read from a subtitle stream, with its text kept as bytes.
+
+        index                -- Index of the cue (that of the previous cue if
+                                it has no index line), or its position from 1
+                                in formats without indexes
+        start_time           -- Start time (in millisecond)
+        end_time             -- End time (in millisecond)
+        settings             -- Data specific to the format, kept when the
+                                cue is written in the same format: for SRT,
+                                the bytes following the timestamps on the
+                                timing line (e.g. coordinates)
+        lines                -- Text lines, without line endings
+    """
+    __slots__ = ()
+
+
+
+def read_srt_cues(input_lines):
+    """
+    Yields the cues of a SRT stream as Cue tuples. Only one cue is held in
+    memory at a time. Lines outside cues are skipped.
+
+        input_lines          -- Iterable of byte lines, e.g. a binary file
+    """
+    match = _TIME_LINE_BYTES_PATTERN.match
+    index = 0
+    cue = None
+    expect_index = True
+    for each_line in input_lines:
+        each_line = each_line.rstrip(b'\r\n')
+        if cue is not None:
+            if each_line.strip():
+                cue[4].append(each_line)
+                continue
+            yield Cue(*cue)
+            cue = None
+            expect_index = True
+            continue
+
+        stripped = each_line.strip().lstrip(b'\xef\xbb\xbf')
+        if expect_index and stripped.isdigit():
+            index = int(stripped)
+            expect_index = False
+            continue
+        is_time_line = match(stripped)
+        if is_time_line is None:
+            expect_index = True
+            continue
+        (sh, sm, ss, sms, eh, em, es, ems) = is_time_line.groups()
+        cue = [index, \
+            (int(sh) * 3600 + int(sm) * 60 + int(ss)) * 1000 + int(sms), \
+            (int(eh) * 3600 + int(em) * 60 + int(es)) * 1000 + int(ems), \
+            stripped[_TIME_LINE_WIDTH:], []]
+    if cue is not None:
+        yield Cue(*cue)
+
+
+
+def write_srt_cues(cues, newline=b'\n'):
+    """
+    Yields the SRT byte lines of an iterable of Cue tuples, numbered from 1.
+
+        cues                 -- Iterable of Cue tuples
+        newline              -- Line ending (as bytes)
+    """
+    for number, cue in enumerate(cues, 1):
+        yield str(number).encode('ascii') + newline
+        yield (ms_to_str(cue.start_time) + ' --> ' + \
+            ms_to_str(cue.end_time)).encode('ascii') + cue.settings + newline
+        for each_line in cue.lines:
+            yield each_line + newline
+        yield newline
+
+
+
+def _apply_to_cues(cues, pipeline):
+    """
+    Yields the cues with the operations of 'pipeline' applied to their
+    times.
+    """
+    for cue in cues:
+        (start_time, end_time) = pipeline.apply(cue.index, cue.start_time, \
+            cue.end_time)
+        if (start_time, end_time) == (cue.start_time, cue.end_time):
+            yield cue
+        else:
+            yield cue._replace(start_time=start_time, end_time=end_time)
+
+
+
+def merge_tracks(input_files, output_file, offsets=None, newline='\n'):
+    """
+    Merges subtitle tracks (e.g. dialogue and SDH, or forced narratives) into
+    one SRT file, after synchronizing each track on its own. The tracks are
+    streamed and interleaved by start time with a k-way merge on a heap, so
+    one cue per track is held in memory, and the cues are renumbered from 1.
+    Cues starting together keep the order of the tracks. Each track must be
+    in time order, as SRT files normally are. Unlike the sync_* functions,
+    errors are raised instead of printed.
+
+        merge_tracks(['dialogue.srt', 'sdh.srt'], 'merged.srt', [0, -400])
+
+        input_files          -- Paths to the input SRT files
+        output_file          -- Path to the merged SRT file
+        offsets              -- One item per input file: time (in
+                                millisecond, rounded if not an integer) by
+                                which the track is delayed (hastened if
+                                negative), a SyncPipeline without repair
+                                stage, or None to keep the track as it is
+        newline              -- Line ending of the merged file
+    """
+    if offsets is None:
+        offsets = [None] * len(input_files)
+    if len(offsets) != len(input_files):
+        raise ValueError('One offset is needed per input file')
+    pipelines = []
+    for offset in offsets:
+        if isinstance(offset, numbers.Real):
+            offset = int(round(offset))
+            offset = SyncPipeline().sync(abs(offset), offset >= 0)
+        elif offset is not None and not isinstance(offset, SyncPipeline):
+            raise TypeError('An offset must be a number of milliseconds, a ' \
+                'SyncPipeline or None, not ' + type(offset).__name__)
+        elif getattr(offset, 'repair_options', None) is not None:
+            raise ValueError('A repair stage cannot apply to a merged ' \
+                'track; use SyncPipeline.run() on the merged file instead.')
+        pipelines.append(offset)
+    for input_file in input_files:
+        if not input_file.endswith(_SRT_EXTENSIONS):
+            raise ValueError('File needs to have .srt extension: ' + \
+                input_file)
+    with contextlib.ExitStack() as stack:
+        tracks = []
+        for input_file, pipeline in zip(input_files, pipelines):
+            cues = read_srt_cues(stack.enter_context(open_subtitle(input_file)))
+            if pipeline is not None:
+                cues = _apply_to_cues(cues, pipeline)
+            tracks.append(cues)
+        with AtomicFileWriter(output_file) as writer:
+            writer.writelines(write_srt_cues(heapq.merge(*tracks, \
+                key=lambda cue: cue.start_time), newline.encode('ascii')))
+
+
+
+class SubtitleCodec(object):
+    """
+    Base class of the subtitle format codecs. A codec instance reads or
+    writes one stream: read() yields the Cue tuples of byte lines, keeping
+    what comes before the first cue in 'header' and the line ending in
+    'newline'; write() yields the byte lines of Cue tuples.
+
+    The Cue settings and the header are specific to a format: write() keeps
+    those of the 'source' codec that read the cues only if it is of the same
+    format. Codecs are picked by file extension from SUBTITLE_CODECS, where
+    other formats can be registered.
+    """
+
+    def __init__(self):
+        self.header = []
+        self.newline = b'\n'
+
+    def read(self, input_lines):
+        """
+        Yields the cues of an iterable of byte lines, e.g. a binary file.
+        """
+        raise NotImplementedError
+
+    def write(self, cues, source=None, newline=None):
+        """
+        Yields the byte lines of an iterable of Cue tuples.
+
+            cues             -- Iterable of Cue tuples
+            source           -- Codec that read the cues
+            newline          -- Line ending, that of 'source' by default
+        """
+        raise NotImplementedError
+
+    def _lines(self, input_lines):
+        input_lines = iter(input_lines)
+        for first_line in input_lines:
+            if first_line.endswith(b'\r\n'):
+                self.newline = b'\r\n'
+            yield first_line
+            yield from input_lines
+
+    def _start_writing(self, cues, source, newline):
+        """
+        Returns the cues, whether the header and settings of 'source' are
+        kept, and the line ending. The first cue is read ahead, so that the
+        header of 'source' is complete.
+        """
+        cues = iter(cues)
+        for first_cue in cues:
+            cues = itertools.chain([first_cue], cues)
+            break
+        if newline is None:
+            newline = b'\n' if source is None else source.newline
+        return (cues, type(source) is type(self), newline)
+
+
+
+class SrtCodec(SubtitleCodec):
+    """
+    SubRip (.srt) codec. The cues are renumbered from 1 when written.
+    """
+
+    def read(self, input_lines):
+        return read_srt_cues(self._lines(input_lines))
+
+    def write(self, cues, source=None, newline=None):
+        (cues, same_format, newline) = self._start_writing(cues, source, \
+            newline)
+        if not same_format:
+            cues = (cue._replace(settings=b'') for cue in cues)
+        return write_srt_cues(cues, newline)
+
+
+
+_VTT_TIME_LINE_BYTES_PATTERN = re.compile(\
+    rb'(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})[ \t]+-->[ \t]+' \
+    rb'(?:(\d+):)?(\d{2}):(\d{2})\.(\d{3})(.*)')
+
+
+
+class WebVttCodec(SubtitleCodec):
+    """
+    WebVTT (.vtt) codec. The cue identifiers and settings are kept as the
+    Cue settings, an (identifier, settings) tuple; the index of a cue is
+    its position. The blocks before the first cue (WEBVTT line, STYLE,
+    REGION, NOTE) are the header; NOTE blocks between cues are skipped.
+    """
+
+    def read(self, input_lines):
+        match = _VTT_TIME_LINE_BYTES_PATTERN.match
+        position = 0
+        block = []
+        for each_line in itertools.chain(self._lines(input_lines), [b'']):
+            if each_line.strip():
+                block.append(each_line)
+                continue
+            timing = None
+            if block:
+                line = block[0].strip()
+                timing = match(line)
+                identifier = None
+                if timing is None and len(block) > 1:
+                    identifier = line
+                    timing = match(block[1].strip())
+            if timing is None:
+                if not position:
+                    self.header.extend(block)
+                    self.header.append(each_line)
+                block = []
+                continue
+
+            (sh, sm, ss, sms, eh, em, es, ems, settings) = timing.groups()
+            position += 1
+            yield Cue(position, \
+                (int(sh or 0) * 3600 + int(sm) * 60 + int(ss)) * 1000 + \
+                int(sms), \
+                (int(eh or 0) * 3600 + int(em) * 60 + int(es)) * 1000 + \
+                int(ems), (identifier, settings.rstrip()), \
+                [each_block_line.rstrip(b'\r\n') for each_block_line in \
+                    block[1 if identifier is None else 2:]])
+            block = []
+
+    def write(self, cues, source=None, newline=None):
+        (cues, same_format, newline) = self._start_writing(cues, source, \
+            newline)
+        if same_format and source.header:
+            yield from source.header
+        else:
+            yield b'WEBVTT' + newline + newline
+        for cue in cues:
+            timing = (ms_to_str(cue.start_time) + ' --> ' + \
+                ms_to_str(cue.end_time)).replace(',', '.').encode('ascii')
+            if same_format:
+                (identifier, settings) = cue.settings
+                if identifier is not None:
+                    yield identifier + newline
+                timing += settings
+            yield timing + newline
+            for each_line in cue.lines:
+                yield each_line + newline
+            yield newline
+
+
+
+_ASS_TIME_BYTES_PATTERN = re.compile(rb'\s*(\d+):(\d{2}):(\d{2})\.(\d{2})\s*$')
+_ASS_FIELDS = (b'Layer', b'Start', b'End', b'Style', b'Name', b'MarginL', \
+    b'MarginR', b'MarginV', b'Effect', b'Text')
+_SSA_FIELDS = (b'Marked',) + _ASS_FIELDS[1:]
+_ASS_HEADER = (b'[Script Info]', b'ScriptType: v4.00+', b'', \
+    b'[V4+ Styles]', \
+    b'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, ' \
+    b'OutlineColour, BackColour, Bold, Italic, Underline, StrikeOut, ' \
+    b'ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, ' \
+    b'Alignment, MarginL, MarginR, MarginV, Encoding', \
+    b'Style: Default,Arial,20,&H00FFFFFF,&H000000FF,&H00000000,&H00000000,' \
+    b'0,0,0,0,100,100,0,0,1,2,2,2,10,10,10,1', b'', \
+    b'[Events]', b'Format: ' + b', '.join(_ASS_FIELDS))
+_SSA_HEADER = (b'[Script Info]', b'ScriptType: v4.00', b'', \
+    b'[V4 Styles]', \
+    b'Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, ' \
+    b'TertiaryColour, BackColour, Bold, Italic, BorderStyle, Outline, ' \
+    b'Shadow, Alignment, MarginL, MarginR, MarginV, AlphaLevel, Encoding', \
+    b'Style: Default,Arial,20,16777215,255,0,0,0,0,1,2,2,2,10,10,10,0,1', \
+    b'', b'[Events]', b'Format: ' + b', '.join(_SSA_FIELDS))
+
+
+
+def _ms_to_ass_time(time_in_ms):
+    centiseconds = (time_in_ms + 5) // 10
+    return '{}:{:02}:{:02}.{:02}'.format(centiseconds // 360000, \
+        centiseconds // 6000 % 60, centiseconds // 100 % 60, \
+        centiseconds % 100).encode('ascii')
+
+
+
+class AssCodec(SubtitleCodec):
+    """
+    Advanced SubStation Alpha (.ass) codec. The Dialogue events are the
+    cues: their fields (style, margins, effect...) are kept as the Cue
+    settings, and the \\N line breaks of their text give the Cue lines
+    (override tags are left in the text). Everything before the first event
+    is the header; Comment events after it are skipped. Times have a
+    precision of 10 ms in this format.
+    """
+    HEADER = _ASS_HEADER
+    FIELDS = _ASS_FIELDS
+    # Values of the FIELDS of a cue read from another format; None for the
+    # times and the text
+    DEFAULT_SETTINGS = (b'0', None, None, b'Default', b'', b'0', b'0', b'0', \
+        b'', None)
+
+    def __init__(self):
+        SubtitleCodec.__init__(self)
+        self.fields = None
+
+    def read(self, input_lines):
+        in_events = False
+        position = 0
+        for each_line in self._lines(input_lines):
+            line = each_line.strip()
+            if self.fields is None or not line.startswith(b'Dialogue:'):
+                if line.startswith(b'['):
+                    in_events = line.lower() == b'[events]'
+                elif in_events and line.startswith(b'Format:'):
+                    self.fields = [field.strip().lower() for field in \
+                        line[7:].split(b',')]
+                    if not {b'start', b'end', b'text'} <= set(self.fields):
+                        raise ValueError('Invalid event format: ' + \
+                            line.decode('utf-8', 'replace'))
+                if not position:
+                    self.header.append(each_line)
+                continue
+
+            values = line[9:].lstrip().split(b',', len(self.fields) - 1)
+            if len(values) != len(self.fields):
+                continue
+            times = []
+            for field in (b'start', b'end'):
+                match = _ASS_TIME_BYTES_PATTERN.match(\
+                    values[self.fields.index(field)])
+                if match is None:
+                    break
+                (h, m, s, cs) = match.groups()
+                times.append((int(h) * 3600 + int(m) * 60 + int(s)) * 1000 + \
+                    int(cs) * 10)
+            if len(times) != 2:
+                continue
+            position += 1
+            yield Cue(position, times[0], times[1], values, \
+                values[self.fields.index(b'text')].split(b'\\N'))
+
+    def write(self, cues, source=None, newline=None):
+        (cues, same_format, newline) = self._start_writing(cues, source, \
+            newline)
+        if same_format and source.fields is not None:
+            fields = source.fields
+            yield from source.header
+        else:
+            fields = [field.lower() for field in self.FIELDS]
+            same_format = False
+            for each_line in self.HEADER:
+                yield each_line + newline
+        (start, end, text) = (fields.index(b'start'), fields.index(b'end'), \
+            fields.index(b'text'))
+        for cue in cues:
+            if same_format:
+                values = list(cue.settings)
+            else:
+                values = list(self.DEFAULT_SETTINGS)
+            values[start] = _ms_to_ass_time(cue.start_time)
+            values[end] = _ms_to_ass_time(cue.end_time)
+            values[text] = b'\\N'.join(cue.lines)
+            yield b'Dialogue: ' + b','.join(values) + newline
+
+
+
+class SsaCodec(AssCodec):
+    """
+    SubStation Alpha v4 (.ssa) codec: the AssCodec reader, and a writer
+    giving cues of another format (or of an ASS file) a v4 header, [V4
+    Styles] section and Marked field instead of the v4+ ones of ASS.
+    """
+    HEADER = _SSA_HEADER
+    FIELDS = _SSA_FIELDS
+    DEFAULT_SETTINGS = (b'Marked=0',) + AssCodec.DEFAULT_SETTINGS[1:]
+
+
+
+SUBTITLE_CODECS = {'.srt': SrtCodec, '.vtt': WebVttCodec, '.ass': AssCodec, \
+    '.ssa': SsaCodec}
+
+
+
+def get_codec(path):
+    """
+    Returns a new codec for a subtitle file, picked from SUBTITLE_CODECS by
+    its extension (under any compression extension, e.g. movie.vtt.gz).
+    Raises ValueError for an unknown format.
+
+        path                 -- Path to the subtitle file
+    """
+    if _compression(path) is not None:
+        path = os.path.splitext(path)[0]
+    try:
+        return SUBTITLE_CODECS[os.path.splitext(path)[1].lower()]()
+    except KeyError:
+        raise ValueError('Unknown subtitle format: ' + path)
+
+
+
+def convert_subtitle(input_file, output_file='', pipeline=None):
+    """
+    Reads a subtitle file in one format (SRT, WebVTT, ASS or SSA, from its
+    extension), applies the operations of a SyncPipeline to its cues and
+    writes it in the format of the output file, in a single streaming pass.
+    The header, cue settings and styles are kept when both files have the
+    same format. Unlike the sync_* functions, errors are raised instead of
+    printed.
+
+        convert_subtitle('movie.ass', 'movie.vtt', SyncPipeline().sync(1500))
+
+        input_file           -- Path to the input subtitle file
+        output_file          -- With default value input file will be replaced.
+                                Change it to get output in different file.
+        pipeline             -- SyncPipeline to be applied (its time and index
+                                ranges use the position of the cues in the
+                                formats without indexes), None to only
+                                convert
+    """
+    if pipeline is not None and pipeline.repair_options is not None:
+        raise ValueError('A repair stage only applies to SRT lines; use ' \
+            'SyncPipeline.run() instead.')
+    if output_file == '':
+        output_file = input_file
+    reader = get_codec(input_file)
+    writer = get_codec(output_file)
+    with open_subtitle(input_file) as inputfile:
+        cues = reader.read(inputfile)
+        if pipeline is not None:
+            cues = _apply_to_cues(cues, pipeline)
+        with AtomicFileWriter(output_file) as outputfile:
+            outputfile.writelines(writer.write(cues, reader))
+
+
+
+def _file_sha256(path):
+    """
+    Returns the SHA-256 hex digest of the content of a file.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as inputfile:
+        for block in iter(lambda: inputfile.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+
+def _sync_watched_file(job):
+    """
+    Synchronizes a file for SyncWatcher. Returns its BatchResult, and the
+    (size, mtime_ns, sha256) of the file once synchronized in place (None if
+    it was written elsewhere or failed).
+
+        job                  -- (pipeline, input_file, output_file) tuple
+    """
+    result = _sync_batch_file(job)
+    if not result.ok or os.path.abspath(result.input_file) != \
+        os.path.abspath(result.output_file):
+        return (result, None)
+    stat = os.stat(result.input_file)
+    return (result, (stat.st_size, stat.st_mtime_ns, \
+        _file_sha256(result.input_file)))
+
+
+
+class SyncWatcher(object):
+    """
+    Watches directories (or glob patterns) for new and changed subtitle
+    files and synchronizes them on a bounded process pool, instead of
+    running sync_batch() over everything on a schedule. The standard library
+    has no portable file change notification, so the files are polled every
+    'interval' seconds; a poll only stats the files, and hashes those whose
+    size or modification time changed.
+
+    A JSON manifest records the size, modification time, SHA-256 hash and
+    operation (the repr() of the pipeline) of every file handled, so only
+    new or changed content is synchronized, also across restarts. A file
+    synchronized in place is recorded with its synchronized content, so an
+    offset is never applied to it twice: touching it or changing the
+    pipeline does not synchronize it again, only new content does. Every
+    file is also journaled before and after it is synchronized, so a file
+    whose synchronization was interrupted with the process is not
+    synchronized twice either. Failed files are retried once they change.
+
+        with SyncWatcher('staging/', SyncPipeline().sync(1500), \\
+            'staging.json') as watcher:
+            watcher.run()
+
+        paths                -- Directories, file paths and glob patterns
+        pipeline             -- SyncPipeline applied to every file
+        manifest_file        -- Path to the JSON manifest (the journal is
+                                kept next to it, with a .journal suffix)
+        output_dir           -- With default value the files are replaced.
+                                Otherwise the output files are written in
+                                this directory, as by sync_batch().
+        max_workers          -- Number of worker processes (defaults to the
+                                number of CPUs).
+        interval             -- Time (in second) between two polls
+        settle_time          -- Files modified less than this time (in
+                                second) ago, or ahead, are left for a later
+                                poll, as they may still be being written
+        recursive            -- Look for SRT files in sub-directories.
+    """
+    MANIFEST_VERSION = 1
+
+    def __init__(self, paths, pipeline, manifest_file, output_dir=None, \
+        max_workers=None, interval=2.0, settle_time=1.0, recursive=True):
+        self.paths = [paths] if isinstance(paths, str) else list(paths)
+        self.pipeline = pipeline
+        self.operation = repr(pipeline)
+        self.manifest_file = manifest_file
+        self.journal_file = manifest_file + '.journal'
+        self.output_dir = output_dir
+        self.output_base_dir = _output_base_dir(self.paths)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.interval = interval
+        self.settle_time = settle_time
+        self.recursive = recursive
+        self.files = {}             # Manifest entries by absolute path
+        self.interrupted = {}       # Hash before the sync, by absolute path
+        self.executor = None
+        self.load()
+
+    def load(self):
+        """
+        Reads the manifest and replays its journal.
+        """
+        try:
+            with open(self.manifest_file, encoding='utf-8') as manifestfile:
+                manifest = json.load(manifestfile)
+        except FileNotFoundError:
+            manifest = {'version': self.MANIFEST_VERSION, 'files': {}}
+        if manifest.get('version') != self.MANIFEST_VERSION:
+            raise ValueError('Unsupported manifest version: ' + \
+                self.manifest_file)
+        self.files = manifest['files']
+        self.interrupted = {}
+        try:
+            with open(self.journal_file, encoding='utf-8') as journalfile:
+                for each_line in journalfile:
+                    try:
+                        record = json.loads(each_line)
+                    except ValueError:
+                        break       # Last line cut short by a crash
+                    if 'started' in record:
+                        self.interrupted[record['path']] = record['started']
+                    else:
+                        self.interrupted.pop(record['path'], None)
+                        self.files[record['path']] = record['entry']
+        except FileNotFoundError:
+            pass
+
+    def save(self):
+        """
+        Writes the manifest atomically and empties the journal.
+        """
+        with AtomicFileWriter(self.manifest_file) as writer:
+            writer.write(json.dumps({'version': self.MANIFEST_VERSION, \
+                'files': self.files}, indent=1, sort_keys=True) \
+                .encode('utf-8'))
+        with open(self.journal_file, 'w', encoding='utf-8'):
+            pass
+
+    def _journal(self, record):
+        with open(self.journal_file, 'a', encoding='utf-8') as journalfile:
+            journalfile.write(json.dumps(record, sort_keys=True) + '\n')
+
+    def _record(self, path, state, error=None):
+        entry = {'size': state[0], 'mtime_ns': state[1], 'sha256': state[2], \
+            'operation': self.operation}
+        if error is not None:
+            entry['error'] = error
+        self.files[path] = entry
+        self._journal({'path': path, 'entry': entry})
+
+    def scan(self):
+        """
+        Returns the (input_file, output_file, (size, mtime_ns, sha256)) of
+        the files to be synchronized, and forgets the files that are gone.
+        """
+        in_place = self.output_dir is None
+        if not in_place:
+            output_dir = os.path.join(os.path.abspath(self.output_dir), '')
+        found = set()
+        jobs = []
+        now = time.time_ns()
+        for input_file in find_srt_files(self.paths, self.recursive):
+            path = os.path.abspath(input_file)
+            if not in_place and path.startswith(output_dir):
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.add(path)
+            entry = self.files.get(path)
+            # A file synchronized in place already has an operation applied,
+            # whichever it was
+            done = entry is not None and \
+                (entry['operation'] == self.operation or \
+                    (in_place and 'error' not in entry))
+            if done and entry['size'] == stat.st_size and \
+                entry['mtime_ns'] == stat.st_mtime_ns:
+                continue
+            # A file modified in the future (clock skew, copies keeping the
+            # time) is not being written either
+            if abs(now - stat.st_mtime_ns) < self.settle_time * 1e9:
+                continue
+            try:
+                state = (stat.st_size, stat.st_mtime_ns, _file_sha256(path))
+            except OSError:
+                continue
+
+            if path in self.interrupted:
+                if in_place and state[2] != self.interrupted.pop(path):
+                    # The sync was committed before the process stopped
+                    self._record(path, state)
+                    continue
+            if done and entry['sha256'] == state[2]:
+                # Touched, not changed
+                entry.update(size=state[0], mtime_ns=state[1])
+                continue
+            jobs.append((path, _batch_output_file(path, self.output_dir, \
+                self.output_base_dir), state))
+        for path in set(self.files) - found:
+            del self.files[path]
+        return jobs
+
+    def run_once(self):
+        """
+        Polls the files once, synchronizes the new and changed ones, saves
+        the manifest and returns a BatchSummary of the files synchronized.
+        """
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(self.max_workers)
+        results = []
+        pending = deque()
+
+        def finish_next_file():
+            (path, state, future) = pending.popleft()
+            (result, synced_state) = future.result()
+            results.append(result)
+            if result.ok:
+                self._record(path, synced_state or state)
+            else:
+                self._record(path, state, '{}: {}'.format(result.error_type, \
+                    result.error_message))
+
+        for (path, output_file, state) in self.scan():
+            self._journal({'path': path, 'started': state[2]})
+            pending.append((path, state, self.executor.submit(\
+                _sync_watched_file, (self.pipeline, path, output_file))))
+            if len(pending) >= 2 * self.max_workers:
+                finish_next_file()
+        while pending:
+            finish_next_file()
+        self.save()
+        return BatchSummary(results)
+
+    def run(self, callback=None):
+        """
+        Polls and synchronizes the files every 'interval' seconds until
+        interrupted (KeyboardInterrupt).
+
+            callback         -- Called with the BatchSummary of every poll
+                                that synchronized files
+        """
+        try:
+            while True:
+                started = time.monotonic()
+                summary = self.run_once()
+                if callback is not None and len(summary):
+                    callback(summary)
+                time.sleep(max(0, self.interval - (time.monotonic() - \
+                    started)))
+        except KeyboardInterrupt:
+            pass
+
+    def close(self):
+        """
+        Stops the worker processes.
+        """
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+
+def _time_str_argument(time_str):
+    try:
+        return time_str_to_ms(time_str)
+    except ValueError as valerr:
+        raise argparse.ArgumentTypeError(str(valerr))
+
+
+
+def main(argv=None):
+    """
+    Command line entry point (python -m sync_subtitle). Reads a subtitle from
+    standard input (or a file) and writes the synchronized subtitle to
+    standard output (or a file), runs the HTTP service (--serve), or watches
+    directories (--watch).
+
+        argv                 -- Command line arguments, sys.argv[1:] by
+                                default
+    """
+    parser = argparse.ArgumentParser(prog='python -m sync_subtitle', \
+        description='Synchronizes i.e. delays, or hastens a subtitle (SRT) ' \
+            'stream.')
+    parser.add_argument('sync_time_in_ms', type=int, nargs='?', \
+        help='time (in millisecond) for which subtitle will be delayed, or ' \
+            'hastened')
+    parser.add_argument('--hasten', action='store_true', \
+        help='hasten the subtitle instead of delaying it')
+    parser.add_argument('--after-time', type=_time_str_argument, \
+        metavar='hh:mm:ss,ms', help='only cues starting after this time')
+    parser.add_argument('--before-time', type=_time_str_argument, \
+        metavar='hh:mm:ss,ms', help='only cues ending before this time')
+    parser.add_argument('--after-index', type=int, metavar='INDEX', \
+        help='only cues with an index greater than this')
+    parser.add_argument('--before-index', type=int, metavar='INDEX', \
+        help='only cues with an index smaller than this')
+    parser.add_argument('--repair', action='store_true', \
+        help='also reorder, trim, drop and renumber the cues as needed')
+    parser.add_argument('-i', '--input', default='-', \
+        help='input file (default: standard input)')
+    parser.add_argument('-o', '--output', default='-', \
+        help='output file (default: standard output)')
+    parser.add_argument('--serve', type=int, metavar='PORT', \
+        help='run the HTTP synchronization service on this port instead')
+    parser.add_argument('--host', default='127.0.0.1', \
+        help='address the service listens on (default: %(default)s)')
+    parser.add_argument('--workers', type=int, \
+        help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--max-request-size', type=int, default=64 << 20, \
+        metavar='BYTES', help='largest accepted request body (default: ' \
+            '%(default)s)')
+    parser.add_argument('--watch', nargs='+', metavar='PATH', \
+        help='watch these directories (or files, glob patterns) and ' \
+            'synchronize new or changed files instead')
+    parser.add_argument('--manifest', default='sync_subtitle.manifest.json', \
+        help='manifest of the watched files (default: %(default)s)')
+    parser.add_argument('--output-dir', \
+        help='directory of the files synchronized by --watch (default: ' \
+            'replace them)')
+    parser.add_argument('--interval', type=float, default=2.0, \
+        metavar='SECONDS', help='time between two polls of --watch ' \
+            '(default: %(default)s)')
+    args = parser.parse_args(argv)
+
+    if args.serve is not None:
+        serve(args.host, args.serve, args.workers, args.max_request_size)
+        return 0
+    if args.sync_time_in_ms is None:
+        parser.error('the following arguments are required: sync_time_in_ms')
+
+    pipeline = SyncPipeline().add(TimeShift(args.sync_time_in_ms, \
+        not args.hasten, after_time_in_ms=args.after_time, \
+        before_time_in_ms=args.before_time, after_index=args.after_index, \
+        before_index=args.before_index))
+    if args.repair:
+        pipeline.repair()
+    if args.watch:
+        with SyncWatcher(args.watch, pipeline, args.manifest, \
+            args.output_dir, args.workers, args.interval) as watcher:
+            watcher.run(lambda summary: print(summary, file=sys.stderr))
+        return 0
+    try:
+        inputfile = sys.stdin.buffer if args.input == '-' else \
+            open_subtitle(args.input)
+        try:
+            if args.output == '-':
+                sync_stream(inputfile, sys.stdout.buffer, pipeline)
+                sys.stdout.buffer.flush()
+            else:
+                # The input is read in full before the output replaces it,
+                # so both can be the same file
+                with AtomicFileWriter(args.output) as outputfile:
+                    sync_stream(inputfile, outputfile, pipeline)
+        finally:
+            if inputfile is not sys.stdin.buffer:
+                inputfile.close()
+    except IOError as ioerr:
+        print('File error: ' + str(ioerr), file=sys.stderr)
+        return 1
+    return 0
+
+
+
+if __name__ == '__main__':
+    sys.exit(main())
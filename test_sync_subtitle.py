@@ -0,0 +1,597 @@
+"""
+Tests of the sync_subtitle module
+
+    python -m unittest test_sync_subtitle
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+import sync_subtitle
+
+
+
+def make_srt(cue_count, start_in_ms=1000, step_in_ms=3000):
+    """
+    Returns the content of a SRT file with 'cue_count' cues, as bytes.
+    """
+    lines = []
+    for index in range(1, cue_count + 1):
+        start_time = start_in_ms + (index - 1) * step_in_ms
+        lines += [str(index), sync_subtitle.ms_to_str(start_time) + ' --> ' + \
+            sync_subtitle.ms_to_str(start_time + 2000), \
+            'Line {} text'.format(index), '']
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+
+def first_start_time(srt_file):
+    """
+    Returns the start time (in millisecond) of the first cue of a file.
+    """
+    with sync_subtitle.open_subtitle(srt_file) as inputfile:
+        return next(sync_subtitle.read_srt_cues(inputfile)).start_time
+
+
+
+class TempDirTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='sync_subtitle_test_')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def path(self, *names):
+        return os.path.join(self.directory, *names)
+
+    def write(self, name, data):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as outputfile:
+            outputfile.write(data)
+        return path
+
+    def read(self, name):
+        with open(self.path(name), 'rb') as inputfile:
+            return inputfile.read()
+
+
+
+class ConcurrentSyncTest(TempDirTestCase):
+    """
+    Index-based synchronizations once shared the tokenizer state of the
+    module; concurrent calls must give the same results as serial ones.
+    """
+    THREADS = 32
+    ROUNDS = 4
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.write('input.srt', make_srt(300))
+
+    def run_threads(self, jobs):
+        errors = []
+        barrier = threading.Barrier(len(jobs))
+
+        def run(function, kwargs):
+            try:
+                barrier.wait()
+                for _ in range(self.ROUNDS):
+                    function(**kwargs)
+            except Exception as err:
+                errors.append(err)
+
+        threads = [threading.Thread(target=run, args=job) for job in jobs]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_index_syncs_in_threads(self):
+        cases = [
+            (sync_subtitle.sync_after_index, {'index': 100}, 1500),
+            (sync_subtitle.sync_before_index, {'index': 50}, 700),
+            (sync_subtitle.sync_between_indexes, \
+                {'start_index': 20, 'end_index': 250}, 900),
+        ]
+        expected = []
+        for (function, bounds, sync_time_in_ms) in cases:
+            output_file = self.path('expected.srt')
+            function(input_file=self.path('input.srt'), \
+                sync_time_in_ms=sync_time_in_ms, output_file=output_file, \
+                **bounds)
+            expected.append(self.read('expected.srt'))
+
+        jobs = []
+        for number in range(self.THREADS):
+            (function, bounds, sync_time_in_ms) = cases[number % len(cases)]
+            kwargs = dict(bounds, input_file=self.path('input.srt'), \
+                sync_time_in_ms=sync_time_in_ms, \
+                output_file=self.path('out{}.srt'.format(number)))
+            jobs.append((function, kwargs))
+        self.run_threads(jobs)
+        for number in range(self.THREADS):
+            self.assertEqual(self.read('out{}.srt'.format(number)), \
+                expected[number % len(cases)], 'thread {}'.format(number))
+
+    def test_between_indexes_with_index_in_threads(self):
+        self.write('indexed.srt', make_srt(300))
+        sync_subtitle.sync_between_indexes(20, 250, self.path('input.srt'), \
+            900, output_file=self.path('expected.srt'))
+        expected = self.read('expected.srt')
+        jobs = [(sync_subtitle.sync_between_indexes, \
+            {'start_index': 20, 'end_index': 250, \
+                'input_file': self.path('indexed.srt'), \
+                'sync_time_in_ms': 900, 'use_index': True, \
+                'output_file': self.path('out{}.srt'.format(number))}) \
+            for number in range(self.THREADS)]
+        self.run_threads(jobs)
+        for number in range(self.THREADS):
+            self.assertEqual(self.read('out{}.srt'.format(number)), expected)
+
+
+
+class SyncWatcherTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.write(os.path.join('staging', 'a.srt'), make_srt(20))
+        self.write(os.path.join('staging', 'season', 'b.srt'), make_srt(20))
+        self.cwd = os.getcwd()
+        os.chdir(self.directory)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        TempDirTestCase.tearDown(self)
+
+    def watcher(self, pipeline=None, settle_time=0, **kwargs):
+        return sync_subtitle.SyncWatcher('staging', \
+            pipeline or sync_subtitle.SyncPipeline().sync(1000), \
+            'staging.json', max_workers=2, settle_time=settle_time, **kwargs)
+
+    def touch(self, path, seconds):
+        touched = time.time() + seconds
+        os.utime(path, (touched, touched))
+        return os.stat(path).st_mtime_ns
+
+    def test_relative_path_synced_once(self):
+        with self.watcher() as watcher:
+            self.assertEqual(len(watcher.run_once()), 2)
+            for _ in range(3):
+                self.assertEqual(len(watcher.run_once()), 0)
+        with self.watcher() as watcher:
+            self.assertEqual(len(watcher.run_once()), 0)
+        self.assertEqual(first_start_time('staging/a.srt'), 2000)
+        self.assertEqual(first_start_time('staging/season/b.srt'), 2000)
+
+    def test_touched_file_not_synced_again(self):
+        with self.watcher() as watcher:
+            watcher.run_once()
+            mtime_ns = self.touch('staging/a.srt', -100)
+            self.assertEqual(len(watcher.run_once()), 0)
+            entry = watcher.files[os.path.abspath('staging/a.srt')]
+            self.assertEqual(entry['mtime_ns'], mtime_ns)
+        with self.watcher(sync_subtitle.SyncPipeline().sync(50)) as watcher:
+            self.assertEqual(len(watcher.run_once()), 0)
+        self.assertEqual(first_start_time('staging/a.srt'), 2000)
+
+    def test_settle_time(self):
+        self.touch('staging/a.srt', -100)
+        self.touch('staging/season/b.srt', 1000)
+        with self.watcher(settle_time=5) as watcher:
+            self.assertEqual(len(watcher.run_once()), 2)
+            self.write(os.path.join('staging', 'a.srt'), make_srt(20))
+            self.assertEqual(len(watcher.run_once()), 0)
+
+    def test_new_content_synced(self):
+        with self.watcher() as watcher:
+            watcher.run_once()
+            self.write(os.path.join('staging', 'a.srt'), make_srt(20))
+            self.assertEqual(len(watcher.run_once()), 1)
+        self.assertEqual(first_start_time('staging/a.srt'), 2000)
+
+
+
+class CommandLineTest(TempDirTestCase):
+
+    def test_output_same_as_input(self):
+        srt_file = self.write('movie.srt', make_srt(10))
+        self.assertEqual(sync_subtitle.main(['500', '-i', srt_file, '-o', \
+            srt_file]), 0)
+        self.assertEqual(first_start_time(srt_file), 1500)
+        with open(srt_file, 'rb') as inputfile:
+            self.assertEqual(len(inputfile.read()), len(make_srt(10)))
+
+    def test_output_compressed(self):
+        srt_file = self.write('movie.srt', make_srt(10))
+        output_file = self.path('movie.srt.gz')
+        self.assertEqual(sync_subtitle.main(['500', '--hasten', '-i', \
+            srt_file, '-o', output_file]), 0)
+        self.assertEqual(first_start_time(output_file), 500)
+
+
+
+class SyncBatchTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.write(os.path.join('s1', 'ep1.srt'), make_srt(10))
+        self.write(os.path.join('s2', 'ep1.srt'), make_srt(10, 5000))
+        os.makedirs(self.path('elsewhere'))
+        self.cwd = os.getcwd()
+        os.chdir(self.path('elsewhere'))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        TempDirTestCase.tearDown(self)
+
+    def test_same_names_outside_current_dir(self):
+        summary = sync_subtitle.sync_batch([self.path('s1'), \
+            self.path('s2')], sync_subtitle.SyncPipeline().sync(1000), \
+            output_dir=self.path('out'), max_workers=1)
+        self.assertEqual(len(summary.succeeded), 2)
+        self.assertEqual(len(set(result.output_file \
+            for result in summary)), 2)
+        self.assertEqual(first_start_time(self.path('out', 's1', \
+            'ep1.srt')), 2000)
+        self.assertEqual(first_start_time(self.path('out', 's2', \
+            'ep1.srt')), 6000)
+
+    def test_glob_outside_current_dir(self):
+        summary = sync_subtitle.sync_batch(self.path('s*', '*.srt'), \
+            sync_subtitle.SyncPipeline().sync(1000), \
+            output_dir=self.path('out'), max_workers=1)
+        self.assertEqual(sorted(result.output_file for result in summary), \
+            [self.path('out', 's1', 'ep1.srt'), \
+                self.path('out', 's2', 'ep1.srt')])
+
+    def test_paths_under_current_dir_kept(self):
+        os.chdir(self.directory)
+        sync_subtitle.sync_batch('s1', sync_subtitle.SyncPipeline().sync(1), \
+            output_dir='out', max_workers=1)
+        self.assertTrue(os.path.isfile(self.path('out', 's1', 'ep1.srt')))
+
+    def test_same_file_synchronized_once(self):
+        os.chdir(self.directory)
+        summary = sync_subtitle.sync_batch(['s1', './s1', 's1/*.srt'], \
+            sync_subtitle.SyncPipeline().sync(1000), max_workers=1)
+        self.assertEqual(len(summary), 1)
+        self.assertEqual(first_start_time(self.path('s1', 'ep1.srt')), 2000)
+
+
+
+class RepairStageTest(TempDirTestCase):
+    """
+    The repair stage reorders, trims, drops and renumbers cues in the pass
+    of the synchronization. Entry points working on parsed cues cannot
+    apply it; they must refuse the pipeline instead of skipping the stage.
+    """
+
+    BROKEN_SRT = b'1\n00:00:01,000 --> 00:00:04,000\nOverlapping\n\n' \
+        b'2\n00:00:05,000 --> 00:00:06,000\nThird\n\n' \
+        b'3\n00:00:03,000 --> 00:00:03,500\nOut of order\n\n' \
+        b'4\n00:00:07,000 --> 00:00:07,000\nZero length\n\n' \
+        b'5\n00:00:08,000 --> 00:00:09,000\nLast\n'
+    REPAIRED_SRT = b'1\n00:00:01,500 --> 00:00:03,500\nOverlapping\n\n' \
+        b'2\n00:00:03,500 --> 00:00:04,000\nOut of order\n\n' \
+        b'3\n00:00:05,500 --> 00:00:06,500\nThird\n\n' \
+        b'4\n00:00:08,500 --> 00:00:09,500\nLast\n'
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.srt_file = self.write('movie.srt', make_srt(10))
+        self.pipeline = sync_subtitle.SyncPipeline().sync(500).repair()
+
+    def test_document_apply(self):
+        document = sync_subtitle.SubtitleDocument.from_bytes(make_srt(10))
+        with self.assertRaises(ValueError):
+            document.apply(self.pipeline)
+        self.assertEqual(document.to_bytes(), make_srt(10))
+
+    def test_cache_sync(self):
+        cache = sync_subtitle.SubtitleCache()
+        with self.assertRaises(ValueError):
+            cache.sync(self.srt_file, self.pipeline)
+        with self.assertRaises(ValueError):
+            cache.sync_bytes(make_srt(10), self.pipeline)
+        self.assertEqual(self.read('movie.srt'), make_srt(10))
+
+    def test_merge_tracks(self):
+        with self.assertRaises(ValueError):
+            sync_subtitle.merge_tracks([self.srt_file, self.srt_file], \
+                self.path('merged.srt'), [0, self.pipeline])
+        self.assertFalse(os.path.exists(self.path('merged.srt')))
+
+    def test_repaired_cues(self):
+        srt_file = self.write('broken.srt', self.BROKEN_SRT)
+        stats = sync_subtitle.SyncStats()
+        sync_subtitle.SyncPipeline().sync(500).repair().run(srt_file, \
+            self.path('repaired.srt'), stats)
+        self.assertEqual(self.read('repaired.srt'), self.REPAIRED_SRT)
+        self.assertEqual((stats.cues_reordered, stats.overlaps_trimmed, \
+            stats.cues_dropped, stats.cues_renumbered), (1, 1, 1, 3))
+        self.assertEqual(stats.bytes_written, len(self.REPAIRED_SRT))
+
+    def test_repaired_chunks(self):
+        stats = sync_subtitle.SyncStats()
+        syncer = sync_subtitle.IncrementalSyncer(\
+            sync_subtitle.SyncPipeline().sync(500).repair(), stats)
+        output = b''.join(syncer.feed(self.BROKEN_SRT[start:start + 7]) \
+            for start in range(0, len(self.BROKEN_SRT), 7)) + syncer.close()
+        self.assertEqual(output, self.REPAIRED_SRT)
+        self.assertEqual(stats.bytes_written, len(self.REPAIRED_SRT))
+
+    def test_pipeline_without_repair(self):
+        document = sync_subtitle.SubtitleDocument.from_bytes(make_srt(10))
+        pipeline = sync_subtitle.SyncPipeline().sync(500)
+        self.assertEqual(document.apply(pipeline), 10)
+
+
+
+class TimeStringTest(TempDirTestCase):
+    """
+    The sync_*_time functions accept what they accepted before using
+    SyncPipeline, and print an error for anything else.
+    """
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.srt_file = self.write('movie.srt', make_srt(10))
+
+    def test_trailing_space_accepted(self):
+        sync_subtitle.sync_after_time('00:00:03,000 ', self.srt_file, 500)
+        sync_subtitle.sync_before_time('00:00:03,500 ', self.srt_file, 500)
+        sync_subtitle.sync_between_times('00:00:00,000 ', '00:00:05,000 ', \
+            self.srt_file, 500)
+        with sync_subtitle.open_subtitle(self.srt_file) as inputfile:
+            start_times = [cue.start_time \
+                for cue in sync_subtitle.read_srt_cues(inputfile)]
+        self.assertEqual(start_times[:2], [2000, 4500])
+
+    def test_bad_time_string_printed(self):
+        for time_str in ('00:00:03,000abc', '3000'):
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                sync_subtitle.sync_after_time(time_str, self.srt_file, 500)
+                sync_subtitle.sync_between_times('00:00:00,000', time_str, \
+                    self.srt_file, 500)
+            self.assertEqual(output.getvalue().count('Error: Time string'), 2)
+        self.assertEqual(self.read('movie.srt'), make_srt(10))
+
+
+
+class AtomicFileWriterTest(TempDirTestCase):
+
+    def temp_files(self):
+        return [name for name in os.listdir(self.directory) \
+            if name.endswith('.tmp')]
+
+    def test_failed_commit_discards_temp_file(self):
+        for output_file in ('movie.srt', 'movie.srt.gz'):
+            os.makedirs(self.path(output_file))
+            with self.assertRaises(OSError):
+                with sync_subtitle.AtomicFileWriter(self.path(output_file)) \
+                    as writer:
+                    writer.writelines([make_srt(10)])
+            self.assertEqual(self.temp_files(), [])
+
+    def test_failed_run_discards_temp_file(self):
+        srt_file = self.write('input.srt', make_srt(10))
+        os.makedirs(self.path('output.srt'))
+        with self.assertRaises(OSError):
+            sync_subtitle.SyncPipeline().sync(500).run(srt_file, \
+                self.path('output.srt'))
+        self.assertEqual(self.temp_files(), [])
+
+
+
+class SyncInPlaceTest(TempDirTestCase):
+
+    def test_stats(self):
+        srt_file = self.write('movie.srt', make_srt(10))
+        stats = sync_subtitle.SyncStats()
+        self.assertEqual(sync_subtitle.sync_in_place(srt_file, 500, \
+            stats=stats), 10)
+        self.assertEqual((stats.time_lines_matched, stats.cues_modified, \
+            stats.bytes_read, stats.bytes_written, stats.files), \
+            (10, 10, len(make_srt(10)), 290, 1))
+
+    def test_anchor_stats(self):
+        srt_file = self.write('movie.srt', make_srt(10))
+        stats = sync_subtitle.SyncStats()
+        self.assertIs(sync_subtitle.sync_to_anchors([(0, 500), \
+            (30000, 30500)], srt_file, stats=stats), stats)
+        self.assertEqual((stats.time_lines_matched, stats.cues_modified, \
+            stats.files), (10, 10, 1))
+        self.assertEqual(first_start_time(srt_file), 1500)
+
+    def test_errors_raised(self):
+        srt_file = self.write('movie.srt', make_srt(10))
+        with self.assertRaises(ValueError):
+            sync_subtitle.sync_in_place(srt_file, 360000000)
+        self.assertEqual(self.read('movie.srt'), make_srt(10))
+        with self.assertRaises(ValueError):
+            sync_subtitle.sync_in_place(self.write('movie.txt', b''), 500)
+        with self.assertRaises(ValueError):
+            sync_subtitle.sync_in_place(self.path('movie.srt.gz'), 500)
+        with self.assertRaises(OSError):
+            sync_subtitle.sync_in_place(self.path('missing.srt'), 500)
+
+
+
+class SubtitleDocumentTest(TempDirTestCase):
+
+    RETIMES = [(1, 0), (1, 1500), (1, -1500), (23.976 / 25, 0), \
+        (25 / 23.976, -2000), (0.5, 0), (0.5, -750), (1.001, -30000), \
+        (2, -10 ** 7), (0.999, 250)]
+
+    @unittest.skipIf(sync_subtitle.numpy is None, 'NumPy is not installed')
+    def test_retime_engines(self):
+        rand = random.Random(0)
+        lines = []
+        for index in range(1, 5001):
+            start_time = rand.randint(0, 3600000)
+            end_time = start_time + rand.choice((0, 1, 2, 500, 3000))
+            lines += [str(index), sync_subtitle.ms_to_str(start_time) + \
+                ' --> ' + sync_subtitle.ms_to_str(end_time), 'Text', '']
+        document = sync_subtitle.SubtitleDocument.from_string(\
+            '\n'.join(lines) + '\n')
+        for (scale, offset_in_ms) in self.RETIMES:
+            expected = document.copy()
+            count = expected.retime(scale, offset_in_ms, 'python')
+            result = document.copy()
+            self.assertEqual(result.retime(scale, offset_in_ms, 'numpy'), \
+                count, (scale, offset_in_ms))
+            self.assertEqual(result.start_times, expected.start_times, \
+                (scale, offset_in_ms))
+            self.assertEqual(result.end_times, expected.end_times, \
+                (scale, offset_in_ms))
+
+    def test_byte_order_mark(self):
+        srt_data = b'\xef\xbb\xbf' + make_srt(5)
+        srt_file = self.write('movie.srt', srt_data)
+        document = sync_subtitle.SubtitleDocument.from_bytes(srt_data)
+        self.assertEqual(list(document.indexes), [1, 2, 3, 4, 5])
+        document.sync_after_index(0, 500)
+        sync_subtitle.sync_after_index(0, srt_file, 500, \
+            output_file=self.path('expected.srt'))
+        self.assertEqual(document.to_bytes(), self.read('expected.srt'))
+        sync_subtitle.SubtitleCache().sync(srt_file, \
+            sync_subtitle.SyncPipeline().sync_after_index(0, 500))
+        self.assertEqual(self.read('movie.srt'), self.read('expected.srt'))
+
+
+
+class AsyncSubtitleSyncerTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.srt_file = self.write('movie.srt', make_srt(10))
+        self.opened = []
+        self.release = threading.Event()
+        self.release.set()
+        open_subtitle = sync_subtitle.open_subtitle
+
+        def recording_open_subtitle(*args, **kwargs):
+            self.release.wait()
+            self.opened.append(open_subtitle(*args, **kwargs))
+            return self.opened[-1]
+
+        patcher = mock.patch('sync_subtitle.open_subtitle', \
+            recording_open_subtitle)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sync_and_close(self):
+        async def run():
+            async with sync_subtitle.AsyncSubtitleSyncer() as syncer:
+                await syncer.sync(self.srt_file, 500)
+                self.assertIsNotNone(syncer.executor)
+            return syncer
+
+        syncer = asyncio.run(run())
+        self.assertIsNone(syncer.executor)
+        self.assertEqual(first_start_time(self.srt_file), 1500)
+        self.assertTrue(self.opened[0].closed)
+
+    def test_failed_open_closes_input(self):
+        syncer = sync_subtitle.AsyncSubtitleSyncer()
+        self.addCleanup(syncer.close)
+        with self.assertRaises(OSError):
+            asyncio.run(syncer.sync(self.srt_file, 500, \
+                output_file=self.path('missing', 'movie.srt')))
+        self.assertTrue(self.opened[0].closed)
+
+    def test_cancelled_open_closes_input(self):
+        syncer = sync_subtitle.AsyncSubtitleSyncer()
+        self.release.clear()
+
+        async def run():
+            task = asyncio.ensure_future(syncer.sync(self.srt_file, 500))
+            await asyncio.sleep(0.05)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+
+        asyncio.run(run())
+        self.release.set()
+        syncer.close()
+        self.assertTrue(self.opened[0].closed)
+        self.assertEqual(self.read('movie.srt'), make_srt(10))
+
+
+
+class ConvertSubtitleTest(TempDirTestCase):
+
+    def test_ssa_output(self):
+        srt_file = self.write('movie.srt', make_srt(2))
+        sync_subtitle.convert_subtitle(srt_file, self.path('movie.ssa'))
+        lines = self.read('movie.ssa').splitlines()
+        self.assertIn(b'ScriptType: v4.00', lines)
+        self.assertIn(b'[V4 Styles]', lines)
+        self.assertIn(b'Format: Marked, Start, End, Style, Name, MarginL, ' \
+            b'MarginR, MarginV, Effect, Text', lines)
+        self.assertEqual(lines[-1], b'Dialogue: Marked=0,0:00:04.00,' \
+            b'0:00:06.00,Default,,0,0,0,,Line 2 text')
+        sync_subtitle.convert_subtitle(self.path('movie.ssa'), \
+            self.path('movie2.ssa'), sync_subtitle.SyncPipeline().sync(500))
+        self.assertEqual(self.read('movie2.ssa').splitlines()[-1], \
+            b'Dialogue: Marked=0,0:00:04.50,0:00:06.50,Default,,0,0,0,,' \
+            b'Line 2 text')
+
+    def test_ass_output(self):
+        srt_file = self.write('movie.srt', make_srt(2))
+        sync_subtitle.convert_subtitle(srt_file, self.path('movie.ass'))
+        sync_subtitle.convert_subtitle(self.path('movie.ass'), \
+            self.path('movie.ssa'))
+        lines = self.read('movie.ssa').splitlines()
+        self.assertNotIn(b'[V4+ Styles]', lines)
+        self.assertEqual(lines[-1], b'Dialogue: Marked=0,0:00:04.00,' \
+            b'0:00:06.00,Default,,0,0,0,,Line 2 text')
+        lines = self.read('movie.ass').splitlines()
+        self.assertIn(b'ScriptType: v4.00+', lines)
+        self.assertEqual(lines[-1], b'Dialogue: 0,0:00:04.00,0:00:06.00,' \
+            b'Default,,0,0,0,,Line 2 text')
+
+
+
+class MergeTracksTest(TempDirTestCase):
+
+    def setUp(self):
+        TempDirTestCase.setUp(self)
+        self.dialogue = self.write('dialogue.srt', make_srt(3))
+        self.sdh = self.write('sdh.srt', make_srt(3, 2000))
+
+    def start_times(self, offsets):
+        sync_subtitle.merge_tracks([self.dialogue, self.sdh], \
+            self.path('merged.srt'), offsets)
+        with sync_subtitle.open_subtitle(self.path('merged.srt')) as inputfile:
+            return [cue.start_time \
+                for cue in sync_subtitle.read_srt_cues(inputfile)]
+
+    def test_offsets(self):
+        expected = [1000, 1600, 4000, 4600, 7000, 7600]
+        self.assertEqual(self.start_times([0, -400]), expected)
+        self.assertEqual(self.start_times([0.0, -400.4]), expected)
+        self.assertEqual(self.start_times([None, \
+            sync_subtitle.SyncPipeline().sync(400, False)]), expected)
+
+    def test_invalid_offset(self):
+        with self.assertRaises(TypeError):
+            self.start_times([0, '-400'])
+        self.assertFalse(os.path.exists(self.path('merged.srt')))
+
+
+
+if __name__ == '__main__':
+    unittest.main()